@@ -0,0 +1,23 @@
+"""
+Import path setup shared by the benchmark scripts.
+
+Makes the device tree (project/) importable the way it is laid out on
+the board, and adds the stand-ins in bench/stubs for modules the host
+lacks: all MicroPython-only modules on CPython, and only those missing
+from the unix port (e.g. network) on MicroPython, where built-in modules
+take precedence over the path. On CPython it also adds the MicroPython
+extensions of the time module that the device code imports.
+"""
+
+import sys
+
+_here = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+
+sys.path.insert(0, _here + '/../project')
+if sys.implementation.name == 'micropython':
+    sys.path.append(_here + '/stubs')
+else:
+    import time
+    sys.path.insert(0, _here + '/stubs')
+    if not hasattr(time, 'sleep_ms'):
+        time.sleep_ms = lambda ms: time.sleep(ms / 1000)
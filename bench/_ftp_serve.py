@@ -0,0 +1,130 @@
+"""
+Runs uftpd for ftp_load.py in its own process, under CPython.
+
+    python3 bench/_ftp_serve.py <port> <chunk_size> <sessions> [nodelay]
+
+uftpd needs three things the host lacks, which are stood in for here:
+
+- the socket option _SO_REGISTER_HANDLER (20), with which the ESP port
+  calls a function whenever a socket becomes readable. Sockets record
+  their handler instead, and the main thread runs a select() loop that
+  calls it, one handler at a time like the port's event hook;
+- socket methods of the MicroPython stream API (readline, readinto,
+  write, sendall with str);
+- an active network interface: network.WLAN reports the station
+  interface up on 127.0.0.1.
+
+Accepted sockets keep Nagle's algorithm on, as lwIP does, unless the
+nodelay argument is 1. uos comes from bench/stubs. Python heap allocations are traced with
+tracemalloc; on SIGUSR1 the process prints "heap <peak bytes>" for the
+time since the last signal and starts a new peak. Runs until killed.
+"""
+
+import _env  # noqa: F401
+import select
+import signal
+import socket as host_socket
+import sys
+import tracemalloc
+import types
+
+_SO_REGISTER_HANDLER = 20
+_handlers = {}
+nodelay = False
+
+
+class Socket(host_socket.socket):
+    """Host socket with the MicroPython socket API uftpd uses."""
+
+    def setsockopt(self, level, option, value):
+        if option == _SO_REGISTER_HANDLER:
+            if value is None:
+                _handlers.pop(self, None)
+            else:
+                _handlers[self] = value
+            return
+        super().setsockopt(level, option, value)
+
+    def accept(self):
+        fd, addr = self._accept()
+        sock = Socket(self.family, self.type, self.proto, fileno=fd)
+        if nodelay:
+            sock.setsockopt(host_socket.IPPROTO_TCP, host_socket.TCP_NODELAY, 1)
+        return sock, addr
+
+    def sendall(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        super().sendall(data)
+
+    def write(self, data):
+        self.sendall(data)
+        return len(data)
+
+    def readinto(self, buf):
+        return self.recv_into(buf)
+
+    def readline(self):
+        line = b''
+        while True:
+            # peek so that nothing past the newline is consumed
+            data = self.recv(256, host_socket.MSG_PEEK)
+            if not data:
+                return line
+            end = data.find(b'\n')
+            line += self.recv(len(data) if end < 0 else end + 1)
+            if end >= 0:
+                return line
+
+
+class WLAN:
+    """Station interface up on the loopback address, access point down."""
+
+    def __init__(self, interface):
+        self.interface = interface
+
+    def active(self, *args):
+        return self.interface == network.STA_IF
+
+    def ifconfig(self):
+        return ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
+
+
+socket = types.ModuleType('socket')
+socket.__dict__.update(host_socket.__dict__)
+socket.socket = Socket
+sys.modules['socket'] = socket
+
+import network  # noqa: E402
+network.WLAN = WLAN
+
+from home.utils import uftpd  # noqa: E402
+
+
+def report_heap(signum, frame):
+    print("heap", tracemalloc.get_traced_memory()[1], flush=True)
+    tracemalloc.reset_peak()
+
+
+def main():
+    global nodelay
+    port, chunk_size, sessions = (int(arg) for arg in sys.argv[1:4])
+    nodelay = sys.argv[4:5] == ['1']
+    signal.signal(signal.SIGUSR1, report_heap)
+    tracemalloc.start()
+    uftpd.start_ftp_server(port=port, splash=False, chunk_size=chunk_size,
+                           sessions=sessions)
+    print("ready", flush=True)
+    while True:
+        sockets = [sock for sock in list(_handlers) if sock.fileno() >= 0]
+        try:
+            readable = select.select(sockets, [], [], 0.05)[0]
+        except (OSError, ValueError):
+            continue  # a socket was closed between the list and select()
+        for sock in readable:
+            handler = _handlers.get(sock)
+            if handler:
+                handler(sock)
+
+
+main()
@@ -0,0 +1,36 @@
+"""
+Runs a CommandServer for server_load.py in its own process.
+
+    <python|micropython> bench/_serve.py <port> <thread|async> <connections> <buffer_size>
+
+Adds a POST /echo route that returns the request body, so the load
+generator controls the request and response size. Admission limits are
+raised out of the way; everything else uses the server defaults. Runs
+until it is killed.
+"""
+
+import _env  # noqa: F401
+import sys
+import time
+
+from home.utils.command_server import CommandServer
+from home.utils.http_response import CONTENT_TYPE_OCTET
+
+
+def handle_echo(headers, body):
+    return 200, body, CONTENT_TYPE_OCTET
+
+
+def main():
+    port, mode, connections, buffer_size = sys.argv[1:5]
+    server = CommandServer(port=int(port), api_key="bench", mode=mode,
+                           max_connections=int(connections),
+                           buffer_size=int(buffer_size),
+                           rate_limit=100000, burst=100000, heap_floor=0)
+    server.routes['/echo'] = ('POST', handle_echo)
+    server.start()
+    while True:
+        time.sleep(1)
+
+
+main()
@@ -0,0 +1,114 @@
+"""
+Benchmark: uftpd transfer throughput per chunk size.
+
+Runs FTP_client.send_file_data (RETR) and save_file_data (STOR) over a
+local socket pair against a file in a temporary directory, for each
+chunk size the server accepts, and prints MB/s.
+
+    python3 bench/ftp_chunks.py [size_mb]
+
+On the host the socket pair and file system are far faster than LWIP
+and flash, so the figures show the per-chunk overhead (calls into the
+socket and file layers), not device throughput.
+"""
+
+import _env  # noqa: F401
+import os
+import socket
+import sys
+import tempfile
+import time
+import _thread
+
+from home.utils import uftpd
+
+CHUNK_SIZES = (512, 1024, 2048, 4096, 8192)
+DRAIN_SIZE = 65536
+
+
+class DataSocket:
+    """Gives a host socket the write/readinto API of a MicroPython socket."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def readinto(self, buf):
+        return self.sock.recv_into(buf)
+
+    def close(self):
+        self.sock.close()
+
+
+def drain(sock, done):
+    buf = bytearray(DRAIN_SIZE)
+    while sock.recv_into(buf):
+        pass
+    sock.close()
+    done.append(True)
+
+
+def feed(sock, total, done):
+    block = bytes(DRAIN_SIZE)
+    sent = 0
+    while sent < total:
+        sock.sendall(block)
+        sent += len(block)
+    sock.close()
+    done.append(True)
+
+
+def wait(done):
+    while not done:
+        time.sleep(0.001)
+
+
+def retr(client, path):
+    ours, theirs = socket.socketpair()
+    done = []
+    _thread.start_new_thread(drain, (theirs, done))
+    started = time.perf_counter()
+    client.send_file_data(path, DataSocket(ours))
+    wait(done)
+    return time.perf_counter() - started
+
+
+def stor(client, path, total):
+    ours, theirs = socket.socketpair()
+    done = []
+    _thread.start_new_thread(feed, (theirs, total, done))
+    started = time.perf_counter()
+    client.save_file_data(path, DataSocket(ours), "wb")
+    wait(done)
+    return time.perf_counter() - started
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    total = size_mb * 1024 * 1024
+    directory = tempfile.mkdtemp()
+    source = directory + '/source.bin'
+    with open(source, 'wb') as f:
+        block = bytes(DRAIN_SIZE)
+        for _ in range(total // DRAIN_SIZE):
+            f.write(block)
+
+    # A session without a control connection; the transfer methods only
+    # need its state and the module's buffer pool
+    client = uftpd.FTP_client.detached()
+    print(f"{size_mb} MB per transfer")
+    print("chunk      RETR MB/s   STOR MB/s")
+    for chunk in CHUNK_SIZES:
+        uftpd.allocate_buffers(chunk, 1)
+        best_retr = min(retr(client, source) for _ in range(3))
+        best_stor = min(stor(client, directory + '/upload.bin', total) for _ in range(3))
+        print(f"{chunk:5d} {size_mb / best_retr:12.1f} {size_mb / best_stor:11.1f}")
+
+    os.remove(source)
+    os.remove(directory + '/upload.bin')
+    os.rmdir(directory)
+
+
+main()
@@ -0,0 +1,211 @@
+"""
+FTP benchmark: uftpd RETR/STOR throughput, LIST latency and peak heap.
+
+Starts uftpd in a child process (bench/_ftp_serve.py, CPython with
+stand-ins for network, uos and the socket handler callbacks), then runs
+scripted workloads through ftplib over loopback:
+
+    RETR/STOR of 1 KiB, 64 KiB and 1 MiB files
+    LIST of directories with 10, 100 and 500 entries, each time after a
+    MKD/RMD in the directory so the listing is built, not cached
+
+For each workload it reports MB/s (transfers), p50/p95 latency per
+command (from sending it to the 226 reply, PASV included), and the peak
+Python heap the server allocated during the workload. The server's peak
+RSS is printed at the end.
+
+    python3 bench/ftp_load.py --chunk-size 4096
+    python3 bench/ftp_load.py --nodelay
+
+The server's sockets keep Nagle's algorithm on, like lwIP on the board,
+so every command that sends two replies (150, then 226) waits out the
+client's delayed ACK, about 40 ms on Linux. That stall hides the cost of
+the server code in small transfers and listings; --nodelay turns Nagle
+off so they show.
+
+Regression mode compares each workload's score (MB/s, or LISTs per
+second) with a stored baseline keyed by workload, chunk size and
+--nodelay:
+
+    python3 bench/ftp_load.py --save-baseline   # record this machine's numbers
+    python3 bench/ftp_load.py --check           # exit 1 if any score dropped
+
+The server runs with allocation tracing on, which slows it down; the
+figures are for comparing revisions on one machine, not for device
+throughput.
+"""
+
+import argparse
+import ftplib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'baseline.json')
+KB = 1024
+
+# (name, command, file size or directory entries, operations)
+WORKLOADS = (
+    ("retr-1k", "RETR", KB, 200),
+    ("retr-64k", "RETR", 64 * KB, 100),
+    ("retr-1m", "RETR", 1024 * KB, 10),
+    ("stor-1k", "STOR", KB, 200),
+    ("stor-64k", "STOR", 64 * KB, 100),
+    ("stor-1m", "STOR", 1024 * KB, 10),
+    ("list-10", "LIST", 10, 50),
+    ("list-100", "LIST", 100, 50),
+    ("list-500", "LIST", 500, 20),
+)
+
+
+def prepare(root):
+    """Creates the files RETR reads and the directories LIST walks."""
+    for name, command, size, _ in WORKLOADS:
+        if command == "RETR":
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(os.urandom(size))
+        elif command == "LIST":
+            directory = os.path.join(root, name)
+            os.mkdir(directory)
+            for i in range(size):
+                with open(os.path.join(directory, f"file_{i:04d}.py"), 'wb') as f:
+                    f.write(b'x' * (i % 2048))
+
+
+def transfer(ftp, command, path, data, buf):
+    """Runs one RETR, STOR or LIST and waits for its 226."""
+    conn = ftp.transfercmd(f"{command} {path}")
+    if command == "STOR":
+        conn.sendall(data)
+    else:
+        while conn.recv_into(buf):
+            pass
+    conn.close()
+    ftp.voidresp()
+
+
+def run_workload(ftp, server, root, workload, repeat):
+    name, command, size, operations = workload
+    operations = max(1, int(operations * repeat))
+    path = f"{root}/{name}"
+    data = os.urandom(size) if command == "STOR" else None
+    buf = bytearray(64 * KB)
+    latencies = []
+    for _ in range(operations):
+        if command == "LIST":
+            # changing the directory drops its cached listing
+            ftp.mkd(path + "/new")
+            ftp.rmd(path + "/new")
+        started = time.perf_counter()
+        transfer(ftp, command, path, data, buf)
+        latencies.append(time.perf_counter() - started)
+    server.send_signal(signal.SIGUSR1)
+    heap = int(server.stdout.readline().split()[1])
+
+    total = sum(latencies)
+    latencies.sort()
+    result = {
+        "operations": operations,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] * 1000,
+        "peak_heap_kb": heap // KB,
+    }
+    if command == "LIST":
+        result["score"] = operations / total
+        result["unit"] = "list/s"
+    else:
+        result["score"] = operations * size / total / 1e6
+        result["unit"] = "MB/s"
+    return result
+
+
+def load_baselines():
+    try:
+        with open(BASELINE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--chunk-size', type=int, default=4096,
+                        help="uftpd transfer buffer bytes (512..8192)")
+    parser.add_argument('--repeat', type=float, default=1.0,
+                        help="scale the number of operations per workload")
+    parser.add_argument('--nodelay', action='store_true',
+                        help="disable Nagle's algorithm on the server's sockets")
+    parser.add_argument('--port', type=int, default=18721)
+    parser.add_argument('--check', action='store_true',
+                        help="fail if a workload's score is below its baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="allowed score drop for --check (fraction)")
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='ftp_load_')
+    prepare(root)
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, '_ftp_serve.py'), str(args.port),
+         str(args.chunk_size), '1', '1' if args.nodelay else '0'],
+        stdout=subprocess.PIPE, text=True)
+    results = {}
+    try:
+        if server.stdout.readline().strip() != "ready":
+            raise RuntimeError("server did not start")
+        ftp = ftplib.FTP()
+        ftp.connect('127.0.0.1', args.port)
+        ftp.login()
+        ftp.voidcmd('TYPE I')
+        suffix = f"-c{args.chunk_size}" + ("-nodelay" if args.nodelay else "")
+        print(f"chunk size {args.chunk_size}, Nagle {'off' if args.nodelay else 'on'}")
+        print("workload      ops      score         p50 ms   p95 ms   heap KiB")
+        for workload in WORKLOADS:
+            result = run_workload(ftp, server, root, workload, args.repeat)
+            results[f"ftp-{workload[0]}{suffix}"] = result
+            print(f"{workload[0]:10s} {result['operations']:6d} "
+                  f"{result['score']:8.2f} {result['unit']:7s} "
+                  f"{result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+                  f"{result['peak_heap_kb']:9d}")
+        ftp.quit()
+    finally:
+        server.terminate()
+        _, _, usage = os.wait4(server.pid, 0)
+        server.returncode = 0
+        shutil.rmtree(root)
+    print(f"server peak RSS {usage.ru_maxrss} KiB")
+
+    if args.save_baseline:
+        baselines = load_baselines()
+        baselines.update(results)
+        with open(BASELINE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {BASELINE}")
+
+    if args.check:
+        baselines = load_baselines()
+        missing = [name for name in results if name not in baselines]
+        if missing:
+            print(f"no baseline for {', '.join(missing)}; record one with --save-baseline")
+            return 2
+        failed = 0
+        for name, result in results.items():
+            floor = baselines[name]['score'] * (1 - args.tolerance)
+            if result['score'] < floor:
+                print(f"REGRESSION {name}: {result['score']:.1f} < {floor:.1f} {result['unit']} "
+                      f"(baseline {baselines[name]['score']:.1f} - {args.tolerance:.0%})")
+                failed += 1
+        if failed:
+            return 1
+        print(f"ok: {len(results)} workloads within {args.tolerance:.0%} of baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+Benchmark: uftpd MODE Z (zlib stream) against MODE S on project files.
+
+Sends every file of one kind from project/ through
+FTP_client.send_file_data (RETR) and save_file_data (STOR) over a local
+socket pair whose far end is throttled to a given link rate, once in
+stream mode and once in MODE Z, and prints the compression ratio and
+the effective throughput (file bytes per second of transfer).
+
+    python3 bench/ftp_mode_z.py [link_kb_per_s]
+
+The default link rate (500 KB/s) is a typical figure for a station
+upload on a busy 2.4 GHz network. The host compresses far faster than
+the board, so the MODE Z figures are an upper bound; on the device they
+hold as long as deflate keeps up with the link.
+"""
+
+import _env  # noqa: F401
+import os
+import socket
+import sys
+import tempfile
+import time
+import zlib
+import _thread
+
+from home.utils import uftpd
+
+KINDS = ('.py', '.json', '.mpy')
+RECV_SIZE = 4096
+
+
+class DataSocket:
+    """Gives a host socket the write/readinto API of a MicroPython socket."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def readinto(self, buf):
+        return self.sock.recv_into(buf)
+
+    def close(self):
+        self.sock.close()
+
+
+def pace(started, total, rate):
+    """Sleeps until total bytes would have crossed a link of rate bytes/s."""
+    delay = started + total / rate - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def drain(sock, rate, result):
+    buf = bytearray(RECV_SIZE)
+    started = time.perf_counter()
+    total = 0
+    while True:
+        n = sock.recv_into(buf)
+        if not n:
+            break
+        total += n
+        pace(started, total, rate)
+    sock.close()
+    result.append(total)
+
+
+def feed(sock, data, rate, result):
+    started = time.perf_counter()
+    for pos in range(0, len(data), RECV_SIZE):
+        sock.sendall(data[pos:pos + RECV_SIZE])
+        pace(started, min(pos + RECV_SIZE, len(data)), rate)
+    sock.close()
+    result.append(len(data))
+
+
+def wait(result):
+    while not result:
+        time.sleep(0.001)
+    return result[0]
+
+
+def retr(client, path, rate):
+    ours, theirs = socket.socketpair()
+    result = []
+    _thread.start_new_thread(drain, (theirs, rate, result))
+    started = time.perf_counter()
+    client.send_file_data(path, DataSocket(ours))
+    wire = wait(result)
+    return wire, time.perf_counter() - started
+
+
+def stor(client, path, payload, rate):
+    ours, theirs = socket.socketpair()
+    result = []
+    _thread.start_new_thread(feed, (theirs, payload, rate, result))
+    started = time.perf_counter()
+    client.save_file_data(path, DataSocket(ours), "wb")
+    wait(result)
+    return time.perf_counter() - started
+
+
+def compress(data):
+    """zlib stream with the window uftpd accepts for uploads (zlib_window)."""
+    packer = zlib.compressobj(wbits=uftpd.zlib_window)
+    return packer.compress(data) + packer.flush()
+
+
+def project_files(root, kind):
+    for directory, _, names in os.walk(root):
+        for name in sorted(names):
+            if name.endswith(kind):
+                yield os.path.join(directory, name)
+
+
+def main():
+    rate = (int(sys.argv[1]) if len(sys.argv) > 1 else 500) * 1024
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'project')
+    upload = tempfile.mkdtemp() + '/upload.bin'
+
+    # A session without a control connection; the transfer methods only
+    # need its state and the module's buffer pool
+    client = uftpd.FTP_client.detached()
+    uftpd.allocate_buffers(4096, 1)
+    print(f"link {rate // 1024} KB/s, window {1 << uftpd._ZLIB_WBITS} bytes")
+    print("kind   files     KB  ratio   RETR S   RETR Z   STOR S   STOR Z  (KB/s)")
+    for kind in KINDS:
+        paths = list(project_files(root, kind))
+        if not paths:
+            continue
+        raw = wire = 0
+        seconds = [0.0] * 4
+        for path in paths:
+            with open(path, 'rb') as f:
+                data = f.read()
+            raw += len(data)
+            for column, mode_z in ((0, False), (1, True)):
+                client.mode_z = mode_z
+                sent, elapsed = retr(client, path, rate)
+                seconds[column] += elapsed
+                if mode_z:
+                    wire += sent
+                payload = compress(data) if mode_z else data
+                seconds[column + 2] += stor(client, upload, payload, rate)
+        kb = raw / 1024
+        print(f"{kind:5s} {len(paths):6d} {kb:6.0f} {raw / wire:6.2f}"
+              + "".join(f" {kb / s:8.0f}" for s in (seconds[0], seconds[1],
+                                                      seconds[2], seconds[3])))
+
+    os.remove(upload)
+    os.rmdir(os.path.dirname(upload))
+
+
+main()
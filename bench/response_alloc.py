@@ -0,0 +1,129 @@
+"""
+Micro-benchmark: heap allocation per CommandServer response.
+
+Compares the old string-concatenating _create_response with the
+pre-encoded ResponseWriter, writing into a sink that discards the data.
+
+    micropython bench/response_alloc.py    # bytes allocated (gc.mem_alloc)
+    python3 bench/response_alloc.py        # peak transient bytes (tracemalloc)
+
+Neither runtime exposes a raw allocation counter; on MicroPython the
+figure is the exact number of heap bytes allocated per response with the
+collector disabled, which is what drives fragmentation on the device.
+On CPython the writer serializes JSON with json.dumps (json.dump to a
+stream would use the pure-Python encoder), so the figure includes the
+body string that MicroPython's json.dump does not build.
+"""
+
+import _env  # noqa: F401
+import gc
+import json
+import sys
+import time
+
+from home.utils.http_response import ResponseWriter, CONTENT_TYPE_JSON, NOT_FOUND
+
+ROUNDS = 1000
+
+CASES = (
+    ("restart ok", 200, {"message": "Device will restart in 2 seconds"}),
+    ("unauthorized", 401, {"error": "Unauthorized: Invalid API key"}),
+    ("not found", 404, "Not Found"),
+)
+
+
+def legacy_response(status_code, message, content_type="application/json",
+                    keep_alive=False):
+    """The response builder as it was before ResponseWriter."""
+    status_messages = {
+        200: "OK",
+        400: "Bad Request",
+        401: "Unauthorized",
+        404: "Not Found",
+        500: "Internal Server Error",
+        503: "Service Unavailable"
+    }
+
+    if isinstance(message, dict):
+        message = json.dumps(message)
+    body = message.encode()
+
+    status_text = status_messages.get(status_code, "Unknown")
+    response = f"HTTP/1.1 {status_code} {status_text}\r\n"
+    response += f"Content-Type: {content_type}\r\n"
+    response += f"Content-Length: {len(body)}\r\n"
+    response += "Connection: keep-alive\r\n\r\n" if keep_alive else "Connection: close\r\n\r\n"
+
+    return response.encode() + body
+
+
+def discard(data):
+    pass
+
+
+def make_legacy(status_code, message):
+    def respond():
+        discard(legacy_response(status_code, message, keep_alive=True))
+    return respond
+
+
+def make_writer(status_code, message):
+    out = ResponseWriter()
+    out.attach(discard)
+    if isinstance(message, str):
+        message = NOT_FOUND  # the server sends the pre-encoded constant
+
+    def respond():
+        out.send(status_code, message, CONTENT_TYPE_JSON, keep_alive=True)
+    return respond
+
+
+if sys.implementation.name == 'micropython':
+    UNIT = "heap bytes allocated"
+
+    def measure(respond):
+        respond()  # warm up
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        start = time.ticks_us()
+        for _ in range(ROUNDS):
+            respond()
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        allocated = gc.mem_alloc() - before
+        gc.enable()
+        return allocated / ROUNDS, elapsed / ROUNDS
+else:
+    import tracemalloc
+    UNIT = "peak transient bytes"
+
+    def measure(respond):
+        respond()  # warm up
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            respond()
+        elapsed = (time.perf_counter() - start) * 1_000_000
+        gc.collect()
+        tracemalloc.start()
+        total = 0
+        for _ in range(ROUNDS):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            respond()
+            total += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+        return total / ROUNDS, elapsed / ROUNDS
+
+
+def main():
+    print(f"{ROUNDS} responses per case, {UNIT} per response")
+    print("{:<14} {:>12} {:>12} {:>10} {:>10}".format(
+        "case", "legacy", "writer", "legacy us", "writer us"))
+    for name, status_code, message in CASES:
+        old_bytes, old_us = measure(make_legacy(status_code, message))
+        new_bytes, new_us = measure(make_writer(status_code, message))
+        print("{:<14} {:>12.1f} {:>12.1f} {:>10.1f} {:>10.1f}".format(
+            name, old_bytes, new_bytes, old_us, new_us))
+
+
+main()
@@ -0,0 +1,242 @@
+"""
+Load test: CommandServer throughput, tail latency and peak memory.
+
+Starts the server in a child process (bench/_serve.py) under CPython or
+the MicroPython unix port, then drives POST /echo from concurrent
+keep-alive connections and reports requests per second, p50/p95/p99
+latency and the server's peak resident memory.
+
+    python3 bench/server_load.py --mode async --concurrency 4 --size 256
+    python3 bench/server_load.py --server micropython --mode thread
+
+Regression mode compares throughput with a stored baseline, keyed by
+interpreter, mode, concurrency and request size:
+
+    python3 bench/server_load.py --save-baseline   # record this machine's numbers
+    python3 bench/server_load.py --check           # exit 1 if req/s dropped
+
+The load generator itself needs CPython; baselines are only comparable
+on the machine that recorded them.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'baseline.json')
+API_KEY = "bench"
+
+
+class Client:
+    """One keep-alive connection sending the same request over and over."""
+
+    def __init__(self, port, request):
+        self.port = port
+        self.request = request
+        self.sock = None
+        self.buffer = bytearray(65536)
+        self.view = memoryview(self.buffer)
+
+    def connect(self):
+        self.sock = socket.create_connection(('127.0.0.1', self.port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def call(self):
+        """Sends one request and reads the whole response; returns the status code."""
+        if self.sock is None:
+            self.connect()
+        self.sock.sendall(self.request)
+        filled = 0
+        while True:
+            count = self.sock.recv_into(self.view[filled:])
+            if not count:
+                raise ConnectionError("server closed the connection")
+            filled += count
+            end = self.buffer.find(b'\r\n\r\n', 0, filled)
+            if end >= 0:
+                break
+        head = bytes(self.buffer[:end]).lower()
+        status = int(head[9:12])
+        length = 0
+        start = head.find(b'content-length:')
+        if start >= 0:
+            line_end = head.find(b'\r\n', start)
+            length = int(head[start + 15:line_end if line_end >= 0 else len(head)])
+        remaining = end + 4 + length - filled
+        while remaining > 0:
+            count = self.sock.recv_into(self.view, min(remaining, len(self.buffer)))
+            if not count:
+                raise ConnectionError("server closed the connection")
+            remaining -= count
+        if b'connection: close' in head:
+            self.close()  # max_requests reached or error: reconnect next time
+        return status
+
+
+def build_request(size):
+    body = b'x' * size
+    return (b'POST /echo HTTP/1.1\r\nHost: bench\r\nX-Api-Key: ' + API_KEY.encode() +
+            b'\r\nContent-Length: ' + str(size).encode() + b'\r\n\r\n' + body)
+
+
+def wait_for_port(port, process, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("server did not start listening")
+
+
+def run_load(port, concurrency, size, duration, warmup):
+    """Runs the load for warmup + duration seconds; returns (latencies, errors, elapsed)."""
+    request = build_request(size)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    def worker():
+        client = Client(port, request)
+        local = []
+        failed = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                if started >= stop_at:
+                    break
+                try:
+                    ok = client.call() == 200
+                except (OSError, ValueError):
+                    client.close()
+                    ok = False
+                if started >= measure_from:
+                    if ok:
+                        local.append(time.perf_counter() - started)
+                    else:
+                        failed += 1
+        finally:
+            client.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], duration
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(args):
+    """Starts the server, loads it and returns the result dict."""
+    buffer_size = max(4096, args.size + 1024)
+    # Headroom over the client count: a client reconnecting after max_requests
+    # can arrive before the server has released its previous connection
+    connections = 2 * args.concurrency
+    process = subprocess.Popen(
+        [args.server, os.path.join(HERE, '_serve.py'), str(args.port), args.mode,
+         str(connections), str(buffer_size)],
+        stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(args.port, process)
+        latencies, errors, elapsed = run_load(args.port, args.concurrency, args.size,
+                                              args.duration, args.warmup)
+    finally:
+        process.terminate()
+        _, _, usage = os.wait4(process.pid, 0)
+        process.returncode = 0
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_rss_kb": usage.ru_maxrss,
+    }
+
+
+def scenario(args):
+    return f"{os.path.basename(args.server)}-{args.mode}-c{args.concurrency}-s{args.size}"
+
+
+def load_baselines():
+    try:
+        with open(BASELINE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--server', default=sys.executable,
+                        help="interpreter running the server (python3 or micropython)")
+    parser.add_argument('--mode', choices=('thread', 'async'), default='async')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--size', type=int, default=256, help="request body bytes")
+    parser.add_argument('--duration', type=float, default=5.0, help="measured seconds")
+    parser.add_argument('--warmup', type=float, default=1.0)
+    parser.add_argument('--port', type=int, default=18780)
+    parser.add_argument('--check', action='store_true',
+                        help="fail if req/s is below the stored baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="allowed throughput drop for --check (fraction)")
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    result = run(args)
+    name = scenario(args)
+    print(f"{name}: {result['rps']:.1f} req/s, "
+          f"p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms, "
+          f"p99 {result['p99_ms']:.2f} ms, peak RSS {result['peak_rss_kb']} KiB, "
+          f"{result['requests']} ok / {result['errors']} errors")
+
+    if args.save_baseline:
+        baselines = load_baselines()
+        baselines[name] = result
+        with open(BASELINE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {BASELINE}")
+
+    if args.check:
+        baseline = load_baselines().get(name)
+        if baseline is None:
+            print(f"no baseline for {name}; record one with --save-baseline")
+            return 2
+        floor = baseline['rps'] * (1 - args.tolerance)
+        if result['rps'] < floor:
+            print(f"REGRESSION: {result['rps']:.1f} req/s < {floor:.1f} "
+                  f"(baseline {baseline['rps']:.1f} - {args.tolerance:.0%})")
+            return 1
+        print(f"ok: {result['rps']:.1f} req/s >= {floor:.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
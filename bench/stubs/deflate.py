@@ -0,0 +1,64 @@
+# Host stand-in for the MicroPython 'deflate' module, on top of CPython's zlib
+
+import zlib
+
+AUTO = 0
+RAW = 1
+ZLIB = 2
+GZIP = 3
+
+
+class DeflateIO:
+    def __init__(self, stream, format=AUTO, wbits=0, close=False):
+        self.stream = stream
+        self.format = format
+        self.wbits = wbits
+        self.close_stream = close
+        self._deflate = None
+        self._inflate = None
+        self._pending = b''
+
+    def _zlib_wbits(self, bits):
+        # CPython encodes the container in the sign/offset of wbits
+        if self.format == RAW:
+            return -bits
+        if self.format == GZIP:
+            return bits + 16
+        if self.format == AUTO:
+            return bits + 32
+        return bits
+
+    def write(self, data):
+        if self._deflate is None:
+            # MicroPython defaults to a 256-byte window; zlib's minimum is 512
+            bits = max(self.wbits or 8, 9)
+            self._deflate = zlib.compressobj(6, zlib.DEFLATED, self._zlib_wbits(bits))
+        out = self._deflate.compress(bytes(data))
+        if out:
+            self.stream.write(out)
+        return len(data)
+
+    def readinto(self, buf):
+        if self._inflate is None:
+            # wbits 0 takes the window size from the stream header
+            self._inflate = zlib.decompressobj(self._zlib_wbits(self.wbits or 15)
+                                               if self.wbits or self.format != ZLIB else 0)
+        chunk = bytearray(len(buf))
+        while not self._pending:
+            if self._inflate.eof:
+                return 0
+            n = self.stream.readinto(chunk)
+            if not n:
+                return 0
+            self._pending = self._inflate.decompress(bytes(chunk[:n]))
+        n = min(len(buf), len(self._pending))
+        buf[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self):
+        if self._deflate is not None:
+            self.stream.write(self._deflate.flush())
+            self._deflate = None
+        if self.close_stream:
+            self.stream.close()
@@ -0,0 +1,9 @@
+# Host stand-in for the MicroPython 'machine' module
+
+
+def freq(hz=None):
+    return 160000000
+
+
+def reset():
+    raise SystemExit("machine.reset() called")
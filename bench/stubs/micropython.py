@@ -0,0 +1,9 @@
+# CPython stand-in for the MicroPython 'micropython' module
+
+
+def const(value):
+    return value
+
+
+def alloc_emergency_exception_buf(size):
+    pass
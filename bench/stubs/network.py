@@ -0,0 +1,18 @@
+# Host stand-in for the MicroPython 'network' module (no radio attached)
+
+STA_IF = 0
+AP_IF = 1
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+
+    def active(self, *args):
+        return False
+
+    def isconnected(self):
+        return False
+
+    def status(self, param=None):
+        raise OSError("no WiFi on host")
@@ -0,0 +1,2 @@
+# Host stand-in for the MicroPython 'uos' module
+from os import *  # noqa: F401,F403
@@ -0,0 +1,151 @@
+"""
+Benchmark: file writes per upload, with and without write coalescing.
+
+Feeds an upload through the FTP path (FTP_client.save_file_data) and the
+HTTP path (the PUT /fs/ upload sink) from a stream that returns at most
+one TCP segment per read, and counts the file write calls and the MB/s
+for each segment size. "per read" replays the previous behaviour of
+writing every read as it arrives; "blocks" is the current code, which
+writes whole 4096 byte blocks. The FTP buffer pool is allocated at the
+server's default chunk_size (1024), so the FTP rows show that the upload
+block does not depend on it.
+
+    python3 bench/upload_writes.py [size_mb]
+
+Files are opened unbuffered, like on MicroPython, so each write is a
+call into the file system. Host disks absorb small writes far better
+than flash, so the write counts are the figure to compare.
+"""
+
+import _env  # noqa: F401
+import os
+import sys
+import tempfile
+import time
+
+from home.utils import uftpd, command_server
+
+SEGMENT_SIZES = (256, 536, 1460, 4096)
+BLOCK_SIZE = 4096
+
+
+class CountingFile:
+    """Unbuffered file that counts its write calls."""
+
+    writes = 0
+
+    def __init__(self, path, mode):
+        self.file = open(path, mode, buffering=0)
+
+    def write(self, data):
+        CountingFile.writes += 1
+        return self.file.write(data)
+
+    def seek(self, offset):
+        return self.file.seek(offset)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SegmentStream:
+    """Data connection whose reads return at most one segment."""
+
+    def __init__(self, data, segment):
+        self.data = memoryview(data)
+        self.segment = segment
+        self.pos = 0
+
+    def readinto(self, buf):
+        count = min(len(buf), self.segment, len(self.data) - self.pos)
+        buf[0:count] = self.data[self.pos:self.pos + count]
+        self.pos += count
+        return count
+
+    def close(self):
+        pass
+
+
+def ftp_per_read(path, source):
+    mv = uftpd.borrow_buffer()
+    with CountingFile(path, "wb") as file:
+        bytes_read = source.readinto(mv)
+        while bytes_read > 0:
+            file.write(mv[0:bytes_read])
+            bytes_read = source.readinto(mv)
+    uftpd.return_buffer(mv)
+
+
+def ftp_blocks(client, path, source):
+    client.save_file_data(path, source, "wb")
+
+
+def http_per_read(path, source, segment):
+    buf = memoryview(bytearray(segment))
+    with CountingFile(path, "wb") as file:
+        count = source.readinto(buf)
+        while count:
+            file.write(buf[:count])
+            count = source.readinto(buf)
+
+
+def http_blocks(path, source, segment, blocks):
+    buf = memoryview(bytearray(segment))
+    sink = command_server._FileUpload(path, blocks)
+    count = source.readinto(buf)
+    while count:
+        sink.write(buf[:count])
+        count = source.readinto(buf)
+    sink.finish()
+
+
+def measure(run, data, segment):
+    best = None
+    for _ in range(3):
+        CountingFile.writes = 0
+        source = SegmentStream(data, segment)
+        started = time.perf_counter()
+        run(source)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return CountingFile.writes, len(data) / best / 1e6
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    data = os.urandom(size_mb * 1024 * 1024)
+    path = tempfile.mkdtemp() + '/upload.bin'
+
+    # count the writes the device code makes through its module's open()
+    uftpd.open = CountingFile
+    command_server.open = CountingFile
+    uftpd.allocate_buffers(uftpd._CHUNK_SIZE, 1)
+    # A session without a control connection; the transfer methods only
+    # need its state and the module's buffer pool
+    client = uftpd.FTP_client.detached()
+    blocks = []  # the command server's pool of upload block buffers
+
+    runs = (
+        ("ftp  per read", lambda src, seg: ftp_per_read(path, src)),
+        ("ftp  blocks", lambda src, seg: ftp_blocks(client, path, src)),
+        ("http per read", lambda src, seg: http_per_read(path, src, seg)),
+        ("http blocks", lambda src, seg: http_blocks(path, src, seg, blocks)),
+    )
+    print(f"{size_mb} MB upload, {BLOCK_SIZE} byte blocks, FTP chunk_size {uftpd.chunk_size}")
+    print("path           segment    writes     MB/s")
+    for name, run in runs:
+        for segment in SEGMENT_SIZES:
+            writes, rate = measure(lambda src: run(src, segment), data, segment)
+            print(f"{name:13s} {segment:8d} {writes:9d} {rate:8.1f}")
+
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+main()
@@ -104,7 +104,12 @@ class Setup:
         # Start FTP server if enabled  
         if services_config.get("ftp", {}).get("enabled", False):
             try:
-                start_ftp_server(splash=True)
+                ftp_config = services_config["ftp"]
+                start_ftp_server(splash=True,
+                                 chunk_size=ftp_config.get("chunk_size", 1024),
+                                 sessions=ftp_config.get("max_sessions", 3),
+                                 window=ftp_config.get("zlib_window", 10),
+                                 digests=ftp_config.get("digest_cache_size", 256))
                 print("FTP server started")
             except Exception as e:
                 print(f"Failed to start FTP server: {e}")
@@ -115,7 +120,22 @@ class Setup:
                 cmd_config = services_config["command_server"]
                 self.services["command_server"] = CommandServer(
                     port=cmd_config.get("port", 8080),
-                    api_key=cmd_config.get("api_key", "your_secret_api_key")
+                    api_key=cmd_config.get("api_key", "your_secret_api_key"),
+                    mode=cmd_config.get("mode", "thread"),
+                    max_connections=cmd_config.get("max_connections", 4),
+                    timeout=cmd_config.get("timeout", 10),
+                    keep_alive_timeout=cmd_config.get("keep_alive_timeout", 5),
+                    max_requests=cmd_config.get("max_requests", 100),
+                    buffer_size=cmd_config.get("buffer_size", 4096),
+                    max_header_size=cmd_config.get("max_header_size", 1024),
+                    rate_limit=cmd_config.get("rate_limit", 5),
+                    burst=cmd_config.get("burst", 10),
+                    heap_floor=cmd_config.get("heap_floor", 16384),
+                    exec_cache_size=cmd_config.get("exec_cache_size", 8),
+                    static_root=cmd_config.get("static_root"),
+                    static_max_age=cmd_config.get("static_max_age", 86400),
+                    udp_port=cmd_config.get("udp_port"),
+                    max_event_streams=cmd_config.get("max_event_streams", 2)
                 )
                 self.services["command_server"].start()
             except Exception as e:
@@ -244,7 +264,12 @@ def create_default_config():
                 "command_server": {
                     "enabled": True,
                     "port": 8080,
-                    "api_key": "change_this_key"
+                    "api_key": "change_this_key",
+                    "mode": "async",
+                    "max_connections": 4,
+                    "timeout": 10,
+                    "keep_alive_timeout": 5,
+                    "max_requests": 100
                 },
                 "ble": {"enabled": False}
             },
@@ -0,0 +1,140 @@
+"""
+Admission control for the command server.
+
+Connections are admitted before anything is read from them. A client is
+turned away when its IP has run out of rate-limit tokens, when the
+server already has max_in_flight connections open, or when free heap is
+below a floor. Client buckets live in fixed arrays, so checking a
+request does not allocate even under a flood.
+"""
+
+import gc
+from array import array
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:  # CPython (host benchmarks)
+    import time
+
+    def ticks_ms():
+        return (time.perf_counter_ns() // 1_000_000) & 0x3FFFFFFF
+
+    def ticks_diff(end, start):
+        return ((end - start + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+# admit() results; non-zero values index the rejection counters
+ADMITTED = 0
+RATE_LIMITED = 1
+IN_FLIGHT_LIMIT = 2
+HEAP_FLOOR = 3
+
+REASONS = (None, "rate_limit", "in_flight", "heap_floor")
+
+
+class AdmissionControl:
+    def __init__(self, rate=5, burst=10, max_in_flight=4, heap_floor=16384,
+                 max_clients=16):
+        """
+        Creates the limiter with preallocated per-client buckets.
+
+        Args:
+            rate (int): Requests per second refilled into each client's bucket
+            burst (int): Bucket size, i.e. requests a client may send at once
+            max_in_flight (int): Connections served at the same time
+            heap_floor (int): Minimum free heap in bytes to accept a connection
+            max_clients (int): Client IPs tracked; the least recent is evicted
+        """
+        self.rate = rate
+        self.capacity = burst * 1000
+        self.max_in_flight = max_in_flight
+        self.heap_floor = heap_floor
+        self.in_flight = 0
+        self.rejected = array('I', [0] * len(REASONS))
+
+        # Buckets hold milli-tokens so refills stay integer arithmetic
+        self._clients = [None] * max_clients
+        self._tokens = array('I', [0] * max_clients)
+        self._seen = array('I', [0] * max_clients)
+
+    def admit(self, ip):
+        """
+        Decides whether a new connection from ip may be served.
+
+        Returns ADMITTED (and counts the connection as in flight) or the
+        rejection reason. Admitted connections must call release().
+        """
+        if self.in_flight >= self.max_in_flight:
+            return self._reject(IN_FLIGHT_LIMIT)
+        if not self._heap_ok():
+            return self._reject(HEAP_FLOOR)
+        if not self.take_token(ip):
+            return self._reject(RATE_LIMITED)
+        self.in_flight += 1
+        return ADMITTED
+
+    def release(self):
+        """Marks an admitted connection as finished."""
+        self.in_flight -= 1
+
+    def retain(self):
+        """Counts a released connection as in flight again, without the checks."""
+        self.in_flight += 1
+
+    def take_token(self, ip):
+        """Spends one request token from ip's bucket; False if it is empty."""
+        now = ticks_ms()
+        slot = self._slot(ip, now)
+        elapsed = ticks_diff(now, self._seen[slot])
+        if elapsed > self.capacity:
+            elapsed = self.capacity  # a full refill; keeps the product a small int
+        tokens = self._tokens[slot] + elapsed * self.rate
+        if tokens > self.capacity:
+            tokens = self.capacity
+        self._seen[slot] = now
+        if tokens < 1000:
+            self._tokens[slot] = tokens
+            return False
+        self._tokens[slot] = tokens - 1000
+        return True
+
+    def reject_request(self):
+        """Counts a rate-limited request on an already open connection."""
+        self._reject(RATE_LIMITED)
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        return reason
+
+    def _slot(self, ip, now):
+        """Finds ip's bucket, recycling the least recently seen one for new clients."""
+        oldest = 0
+        for i in range(len(self._clients)):
+            if self._clients[i] == ip:
+                return i
+            if ticks_diff(self._seen[i], self._seen[oldest]) < 0:
+                oldest = i
+        self._clients[oldest] = ip
+        self._tokens[oldest] = self.capacity
+        self._seen[oldest] = now
+        return oldest
+
+    def _heap_ok(self):
+        """True if free heap is above the floor, collecting garbage once if needed."""
+        try:
+            if gc.mem_free() >= self.heap_floor:
+                return True
+            gc.collect()
+            return gc.mem_free() >= self.heap_floor
+        except AttributeError:  # CPython has no heap statistics
+            return True
+
+    def render(self, stream):
+        """Writes rejection counters in Prometheus text exposition format."""
+        write = stream.write
+        write("# HELP http_rejected_total Connections and requests refused by admission control.\n")
+        write("# TYPE http_rejected_total counter\n")
+        for reason in range(1, len(REASONS)):
+            write(f'http_rejected_total{{reason="{REASONS[reason]}"}} {self.rejected[reason]}\n')
+        write("# HELP http_in_flight Connections currently being served.\n")
+        write("# TYPE http_in_flight gauge\n")
+        write(f"http_in_flight {self.in_flight}\n")
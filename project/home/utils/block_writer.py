@@ -0,0 +1,75 @@
+"""
+Write coalescing for uploads to flash.
+
+A socket read returns whatever the last TCP segments carried, often a
+few hundred bytes. Writing each of those to littlefs/FAT costs a file
+system call and a read-modify-write of a partial flash block. A
+BlockWriter gathers the data in one buffer and writes it in whole
+blocks at block-aligned file offsets, with a last partial write on
+flush().
+"""
+
+
+class BlockWriter:
+    def __init__(self, file, buf, offset=0):
+        """
+        Wraps an open file for block-sized writes.
+
+        Args:
+            file: File opened for writing, positioned at offset
+            buf (memoryview): Block buffer; its length is the write size
+                (a multiple of the 4096 byte flash sector keeps writes aligned)
+            offset (int): File position of the first byte written; the
+                first block is shortened so the following ones are aligned
+        """
+        self.file = file
+        self.buf = buf
+        self.fill = 0
+        self.limit = len(buf) - offset % len(buf)
+        self.size = 0
+        self.writes = 0
+
+    def write(self, data):
+        """Buffers data, writing out each block as it fills up."""
+        data = memoryview(data)
+        count = len(data)
+        self.size += count
+        while data:
+            room = self.limit - self.fill
+            if self.fill == 0 and len(data) >= room:
+                # a whole block is at hand, write it without copying
+                self.file.write(data[0:room])
+                self.writes += 1
+                self.limit = len(self.buf)
+            else:
+                room = min(room, len(data))
+                self.buf[self.fill:self.fill + room] = data[0:room]
+                self.fill += room
+                if self.fill == self.limit:
+                    self._write_block()
+            data = data[room:]
+        return count
+
+    def readfrom(self, source):
+        """
+        Reads from a stream (readinto) straight into the block buffer.
+        Returns the number of bytes read, 0 at the end of the stream.
+        """
+        count = source.readinto(self.buf[self.fill:self.limit])
+        if count:
+            self.fill += count
+            self.size += count
+            if self.fill == self.limit:
+                self._write_block()
+        return count
+
+    def flush(self):
+        """Writes out the buffered tail; the file stays open."""
+        if self.fill:
+            self._write_block()
+
+    def _write_block(self):
+        self.file.write(self.buf[0:self.fill])
+        self.writes += 1
+        self.fill = 0
+        self.limit = len(self.buf)
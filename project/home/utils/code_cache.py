@@ -0,0 +1,79 @@
+"""
+Compiled-code cache for the command server's /exec endpoint.
+
+Snippets are keyed by the SHA-256 of their source bytes, so a repeated
+snippet is only hashed, never decoded or compiled again. Entries live in
+fixed slots; when all are taken the least recently used one is replaced.
+"""
+
+import hashlib
+from array import array
+
+
+class CodeCache:
+    def __init__(self, size=8):
+        """
+        Creates an empty cache.
+
+        Args:
+            size (int): Number of compiled snippets kept
+        """
+        self._keys = [None] * size
+        self._codes = [None] * size
+        self._used = array('I', [0] * size)
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, source):
+        """
+        Returns (code, is_expression) for source (bytes-like), compiling it
+        on a miss. Expressions are compiled in 'eval' mode so their value
+        can be returned; anything else in 'exec' mode.
+
+        Raises:
+            SyntaxError: If source does not compile (nothing is cached)
+        """
+        key = hashlib.sha256(source).digest()
+        self._clock += 1
+        oldest = 0
+        for i in range(len(self._keys)):
+            if self._keys[i] == key:
+                self.hits += 1
+                self._used[i] = self._clock
+                return self._codes[i]
+            if self._used[i] < self._used[oldest]:
+                oldest = i
+
+        self.misses += 1
+        text = bytes(source).decode()
+        try:
+            entry = (compile(text, '<exec>', 'eval'), True)
+        except SyntaxError:
+            entry = (compile(text, '<exec>', 'exec'), False)
+        if self._keys[oldest] is not None:
+            self.evictions += 1
+        self._keys[oldest] = key
+        self._codes[oldest] = entry
+        self._used[oldest] = self._clock
+        return entry
+
+    def __len__(self):
+        return len(self._keys) - self._keys.count(None)
+
+    def render(self, stream):
+        """Writes the cache counters in Prometheus text exposition format."""
+        write = stream.write
+        write("# HELP exec_cache_hits_total /exec snippets served from the compiled-code cache.\n")
+        write("# TYPE exec_cache_hits_total counter\n")
+        write(f"exec_cache_hits_total {self.hits}\n")
+        write("# HELP exec_cache_misses_total /exec snippets that had to be compiled.\n")
+        write("# TYPE exec_cache_misses_total counter\n")
+        write(f"exec_cache_misses_total {self.misses}\n")
+        write("# HELP exec_cache_evictions_total Compiled snippets dropped to make room.\n")
+        write("# TYPE exec_cache_evictions_total counter\n")
+        write(f"exec_cache_evictions_total {self.evictions}\n")
+        write("# HELP exec_cache_entries Compiled snippets currently cached.\n")
+        write("# TYPE exec_cache_entries gauge\n")
+        write(f"exec_cache_entries {len(self)}\n")
@@ -4,26 +4,125 @@ import socket
 import time
 import _thread
 import gc
+import io
+import os
+from home.utils.http_parser import RequestParser, RequestError
+from home.utils.http_response import (ResponseWriter, SERVICE_UNAVAILABLE, NOT_FOUND,
+                                     CONTINUE, UNTIL_CLOSE, CONTENT_TYPE_JSON,
+                                     CONTENT_TYPE_OCTET, CONTENT_TYPE_PROMETHEUS,
+                                     CONTENT_TYPE_EVENT_STREAM)
+from home.utils.metrics import Metrics, ticks_us
+from home.utils.admission import AdmissionControl, ADMITTED
+from home.utils.telemetry import Telemetry
+from home.utils.code_cache import CodeCache
+from home.utils.static_files import StaticFiles
+from home.utils.udp_commands import UdpCommandChannel
+from home.utils.fs_common import invalidate_listing, forget_digest, replace_file, TEMP_SUFFIX
+from home.utils.block_writer import BlockWriter
+
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+_WWW_AUTHENTICATE = (b'WWW-Authenticate: Bearer\r\n',)
+_NO_CACHE = (b'Cache-Control: no-cache\r\n',)
+_RETRY_AFTER = (b'Retry-After: 1\r\n',)
+
+# Uploads are written to flash in blocks of one 4096 byte sector
+_UPLOAD_BLOCK_SIZE = 4096
+
+# Telemetry event interval bounds in milliseconds
+_EVENTS_DEFAULT_MS = 5000
+_EVENTS_MIN_MS = 500
+_EVENTS_MAX_MS = 3600000
+
+# Responses larger than the writer's buffer go out in two sends; with
+# Nagle on, the second waits for the client's delayed ACK (~40 ms).
+# Not every port's socket module exposes the option.
+_TCP_NODELAY = getattr(socket, 'TCP_NODELAY', None)
 
 class CommandServer:
-    def __init__(self, port=8080, api_key="your_secret_api_key"):
+    def __init__(self, port=8080, api_key="your_secret_api_key", mode="thread",
+                 max_connections=4, timeout=10, keep_alive_timeout=5,
+                 max_requests=100, buffer_size=4096, max_header_size=1024,
+                 rate_limit=5, burst=10, heap_floor=16384, exec_cache_size=8,
+                 static_root=None, static_max_age=86400, udp_port=None,
+                 max_event_streams=2):
         """
         Starts a command server for ESP32.
         
         Args:
             port (int): The port number to listen on
-            api_key (str): API security key
+            api_key (str): API key every request must send as
+                "Authorization: Bearer <key>" or "X-Api-Key: <key>"
+            mode (str): "thread" (one thread per client) or "async" (asyncio streams)
+            max_connections (int): Connections served at once; more get a 503
+            timeout (int): Per-connection read/write timeout in seconds (async mode)
+            keep_alive_timeout (int): Idle seconds before a persistent connection is closed
+            max_requests (int): Requests served on one connection before it is closed
+            buffer_size (int): Per-connection receive buffer, bounds headers + body
+            max_header_size (int): Largest accepted request line + headers
+            rate_limit (int): Requests per second allowed per client IP
+            burst (int): Requests a client IP may send in a burst
+            heap_floor (int): Free heap in bytes below which connections get a 503
+            exec_cache_size (int): Compiled /exec snippets kept for reuse
+            static_root (str): Directory served to browsers (GET on any path
+                without a route, no API key needed); None disables it
+            static_max_age (int): Cache-Control max-age in seconds for static assets
+            udp_port (int): Port for signed single-datagram commands (also
+                broadcast); None disables the UDP channel
+            max_event_streams (int): /events subscribers served at once; they
+                do not count against max_connections
         """
         self.port = port
         self.api_key = api_key
+        self.mode = mode
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_requests = max_requests
+        self.buffer_size = buffer_size
+        self.max_header_size = max_header_size
+        self.max_event_streams = max_event_streams
+        self.event_streams = 0
+        self._slots = []
+        self._upload_blocks = []
         self.server_socket = None
         self.running = False
+        self._async_server = None
+        self.admission = AdmissionControl(rate_limit, burst, max_connections, heap_floor)
+        # path -> (method, handler); handlers return
+        # (status, message[, content_type[, extra pre-encoded header lines]])
         self.routes = {
-            '/restart': self.handle_restart
+            '/restart': ('POST', self.handle_restart),
+            '/metrics': ('GET', self.handle_metrics),
+            '/events': ('GET', self.handle_events),
+            '/batch': ('POST', self.handle_batch),
+            '/exec': ('POST', self.handle_exec)
         }
+        # (method, path prefix, handler, streams_body); checked when no exact route matches.
+        # Streaming handlers get body=None and return an upload sink as the message.
+        self.prefix_routes = (
+            ('GET', '/fs/', self.handle_fs_get, False),
+            ('PUT', '/fs/', self.handle_fs_put, True)
+        )
+        self.static = StaticFiles(static_root, static_max_age) if static_root else None
+        self.metrics = Metrics(list(self.routes) + ['/fs/', '/static'])
+        self.udp = UdpCommandChannel(self, udp_port) if udp_port else None
+        self.telemetry = Telemetry()
+        self.code_cache = CodeCache(exec_cache_size)
 
     def start(self):
         """Starts the server and begins listening for connections."""
+        if self.udp:
+            try:
+                self.udp.start()
+            except Exception as e:
+                print(f"UDP channel start failed: {e}")
+        if self.mode == "async":
+            self._start_async()
+            return
         try:
             addr = socket.getaddrinfo('0.0.0.0', self.port)[0][-1]
             self.server_socket = socket.socket()
@@ -44,114 +143,676 @@ class CommandServer:
         while self.running:
             try:
                 client, addr = self.server_socket.accept()
+                if self.admission.admit(addr[0]) != ADMITTED:
+                    # Shed load before spending a thread or reading the request
+                    self._refuse(client)
+                    continue
                 print(f'Client connected from {addr}')
-                _thread.start_new_thread(self._handle_client, (client, addr))
+                try:
+                    _thread.start_new_thread(self._handle_client, (client, addr))
+                except Exception as e:
+                    # No thread to release the slot it was admitted with
+                    print(f"Error starting client thread: {e}")
+                    self.admission.release()
+                    self._refuse(client)
             except Exception as e:
                 print(f"Error accepting connection: {e}")
             
             # Memory management
             gc.collect()
+
+    def _refuse(self, client):
+        """Sends the canned 503 and closes a connection that was not admitted."""
+        try:
+            client.sendall(SERVICE_UNAVAILABLE)
+        except OSError:
+            pass
+        client.close()
     
     def _handle_client(self, client, addr):
-        """Handles client connection."""
+        """Handles client connection, serving requests until it is closed."""
+        parser, out = self._acquire_slot()
+        out.attach(client.sendall)
+        readinto = getattr(client, 'readinto', None) or client.recv_into
+        served = 0
         try:
-            request = client.recv(1024).decode()
-            if not request:
-                client.close()
-                return
-            
-            method, path, headers, body = self._parse_request(request)
-            print(f"{method} {path}")
-            
-            # Find the appropriate handler for the requested endpoint
-            if path in self.routes and method == 'POST':
-                response = self.routes[path](headers, body)
-            else:
-                response = self._create_response(404, "Not Found")
-            
-            client.send(response)
+            client.settimeout(self.keep_alive_timeout)
+            if _TCP_NODELAY is not None:
+                client.setsockopt(socket.IPPROTO_TCP, _TCP_NODELAY, 1)
+            while self.running:
+                if not parser.complete():
+                    count = readinto(parser.free())
+                    if not count:
+                        break
+                    parser.feed(count)
+                    continue
+
+                if served and not self.admission.take_token(addr[0]):
+                    self.admission.reject_request()
+                    client.sendall(SERVICE_UNAVAILABLE)
+                    break
+
+                served += 1
+                exchange = self._dispatch(parser, out, served < self.max_requests)
+                keep_alive = self._run_exchange(exchange, readinto)
+                self._run_deferred(parser.headers)
+                if not keep_alive:
+                    break
+                parser.consume()
+        except RequestError as e:
+            self._send_error(parser, out, e)
+        except OSError:
+            pass  # idle timeout or peer went away
         except Exception as e:
             print(f"Error handling client: {e}")
         finally:
             client.close()
-    
-    def _parse_request(self, request):
-        """Parses HTTP request."""
-        lines = request.split('\r\n')
-        
-        # Get method and path from the first line
-        request_line = lines[0].split(' ')
-        method = request_line[0]
-        path = request_line[1].split('?')[0]  # ignore query parameters
-        
-        # Parse headers
-        headers = {}
-        body_start = 0
-        for i, line in enumerate(lines[1:], 1):
-            if not line:  # Empty line indicates the end of headers
-                body_start = i + 1
-                break
-            if ':' in line:
-                key, value = line.split(':', 1)
-                headers[key.strip().lower()] = value.strip()
-        
-        # Get the body (if any)
-        body = '\r\n'.join(lines[body_start:]) if body_start < len(lines) else ''
-        
-        return method, path, headers, body
-    
-    def _create_response(self, status_code, message, content_type="application/json"):
-        """Creates HTTP response."""
-        status_messages = {
-            200: "OK",
-            400: "Bad Request",
-            401: "Unauthorized",
-            404: "Not Found",
-            500: "Internal Server Error"
-        }
-        
-        status_text = status_messages.get(status_code, "Unknown")
-        response = f"HTTP/1.1 {status_code} {status_text}\r\n"
-        response += f"Content-Type: {content_type}\r\n"
-        response += "Connection: close\r\n\r\n"
+            self._release_slot(parser, out)
+            self.admission.release()
+
+    def _start_async(self):
+        """Runs the asyncio event loop for the server in a single background thread."""
+        self.running = True
+        _thread.start_new_thread(asyncio.run, (self._serve_async(),))
+
+    async def _serve_async(self):
+        """Main asyncio server - accepts connections as stream pairs."""
+        try:
+            self._async_server = await asyncio.start_server(
+                self._handle_stream, '0.0.0.0', self.port, backlog=self.max_connections)
+            print(f"Command server started on port {self.port} (async)")
+            while self.running:
+                await asyncio.sleep(1)
+        except Exception as e:
+            print(f"Server start failed: {e}")
+        finally:
+            if self._async_server:
+                self._async_server.close()
+                await self._async_server.wait_closed()
+                self._async_server = None
+
+    async def _handle_stream(self, reader, writer):
+        """Handles client connection in async mode."""
+        ip = writer.get_extra_info('peername')[0]
+        if self.admission.admit(ip) != ADMITTED:
+            # Shed load before reading anything from the connection
+            try:
+                writer.write(SERVICE_UNAVAILABLE)
+                await asyncio.wait_for(writer.drain(), self.timeout)
+            except Exception:
+                pass
+            await self._close_stream(writer)
+            return
+
+        parser, out = self._acquire_slot()
+        out.attach(writer.write)
+        served = 0
+        try:
+            while self.running:
+                if not parser.complete():
+                    # The first request gets the full timeout, later ones the idle timeout
+                    timeout = self.keep_alive_timeout if served else self.timeout
+                    count = await asyncio.wait_for(self._read_into(reader, parser.free()), timeout)
+                    if not count:
+                        break
+                    parser.feed(count)
+                    continue
+
+                if served and not self.admission.take_token(ip):
+                    self.admission.reject_request()
+                    writer.write(SERVICE_UNAVAILABLE)
+                    await asyncio.wait_for(writer.drain(), self.timeout)
+                    break
+
+                served += 1
+                exchange = self._dispatch(parser, out, served < self.max_requests)
+                keep_alive = await self._run_exchange_async(exchange, reader, writer)
+                await asyncio.wait_for(writer.drain(), self.timeout)
+                self._run_deferred(parser.headers)
+                if not keep_alive:
+                    break
+                parser.consume()
+        except RequestError as e:
+            self._send_error(parser, out, e)
+            await asyncio.wait_for(writer.drain(), self.timeout)
+        except asyncio.TimeoutError:
+            pass  # idle keep-alive connection
+        except Exception as e:
+            print(f"Error handling client: {e}")
+        finally:
+            self.admission.release()
+            self._release_slot(parser, out)
+            await self._close_stream(writer)
+            # Memory management
+            gc.collect()
+
+    def _send_error(self, parser, out, error):
+        """
+        Answers a request the parser rejected (e.g. 401 from _on_head) and
+        counts it in /metrics under its route, if the request line was read.
+        """
+        started = ticks_us()
+        name = parser.path or ''
+        if parser.path is not None:
+            route = self._find_route(parser.method, parser.path)
+            if route:
+                name = route[0]
+        out.send(error.status, {"error": error.message}, headers=error.headers)
+        self.metrics.record(name, error.status, started)
+
+    def _run_exchange(self, exchange, readinto):
+        """Drives a _dispatch generator on a blocking socket; returns keep_alive."""
+        try:
+            buf = next(exchange)
+            while True:
+                if buf is None:
+                    # Output is flushed with sendall, so drain requests need no work
+                    buf = exchange.send(None)
+                elif isinstance(buf, int):
+                    time.sleep(buf / 1000)
+                    buf = exchange.send(None)
+                else:
+                    buf = exchange.send(readinto(buf))
+        except StopIteration as e:
+            return e.value
+        finally:
+            exchange.close()
+
+    async def _run_exchange_async(self, exchange, reader, writer):
+        """Drives a _dispatch generator on asyncio streams; returns keep_alive."""
+        try:
+            buf = next(exchange)
+            while True:
+                if buf is None:
+                    await asyncio.wait_for(writer.drain(), self.timeout)
+                    buf = exchange.send(None)
+                elif isinstance(buf, int):
+                    await asyncio.sleep(buf / 1000)
+                    buf = exchange.send(None)
+                else:
+                    count = await asyncio.wait_for(self._read_into(reader, buf), self.timeout)
+                    buf = exchange.send(count)
+        except StopIteration as e:
+            return e.value
+        finally:
+            exchange.close()
+
+    async def _read_into(self, reader, buf):
+        """Reads from an asyncio stream straight into buf, returning the byte count."""
+        if hasattr(reader, 'readinto'):
+            return await reader.readinto(buf)
+        data = await reader.read(len(buf))  # streams without readinto (CPython)
+        buf[:len(data)] = data
+        return len(data)
+
+    async def _close_stream(self, writer):
+        """Closes an asyncio stream, ignoring errors from dropped peers."""
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+    def _acquire_slot(self):
+        """
+        Takes a (parser, response writer) pair from the pool, allocating
+        one only when the pool is empty.
+        """
+        try:
+            parser, out = self._slots.pop()
+            parser.reset()
+            return parser, out
+        except IndexError:
+            return (RequestParser(self.buffer_size, self.max_header_size, self._on_head),
+                    ResponseWriter())
+
+    def _release_slot(self, parser, out):
+        """Returns a slot to the pool so its buffers are reused by the next connection."""
+        out.sink = None
+        if len(self._slots) < self.max_connections:
+            self._slots.append((parser, out))
+
+    def _find_route(self, method, path):
+        """Returns (route name, handler, streams_body) for a request, or None."""
+        route = self.routes.get(path)
+        if route:
+            return (path, route[1], False) if route[0] == method else None
+        for route_method, prefix, handler, streams_body in self.prefix_routes:
+            if route_method == method and path.startswith(prefix):
+                return prefix, handler, streams_body
+        if self.static is not None and method == 'GET':
+            return '/static', self.handle_static, False
+        return None
+
+    def _on_head(self, request):
+        """
+        Called by the parser as soon as the headers are in, before any of
+        the body is read: rejects unauthenticated requests for every route
+        except static assets (browsers cannot send the key on page loads)
+        and tells the parser whether the body is streamed.
+        """
+        route = self._find_route(request.method, request.path)
+        if route is not None and route[0] == '/static':
+            return False
+        if not self._authenticated(request.headers):
+            raise RequestError(401, "Unauthorized: Invalid API key", _WWW_AUTHENTICATE)
+        return route is not None and route[2]
+
+    def _authenticated(self, headers):
+        """Checks the Authorization: Bearer or X-Api-Key header against the API key."""
+        key = headers.get('x-api-key')
+        if key is None:
+            authorization = headers.get('authorization', '')
+            if authorization[:7].lower() != 'bearer ':
+                return False
+            key = authorization[7:].strip()
+        return self._key_matches(key)
+
+    def _key_matches(self, key):
+        """Compares key with the API key in constant time (no early exit)."""
+        expected = self.api_key
+        diff = len(key) ^ len(expected)
+        for i in range(len(expected)):
+            diff |= ord(expected[i]) ^ (ord(key[i]) if i < len(key) else 0)
+        return diff == 0
+
+    def _dispatch(self, request, out, keep_alive_allowed=False):
+        """
+        Routes a parsed request and writes its response to out.
+
+        This is a generator so the same code serves the thread and async
+        loops: it yields a buffer when it needs request body bytes read
+        into it (the loop sends back the count), None when pending output
+        should be drained and an int to sleep that many milliseconds.
+        Returns True when the connection may be reused for another request.
+        """
+        started = ticks_us()
+        method, path, headers = request.method, request.path, request.headers
+        print(f"{method} {path}")
+        keep_alive = keep_alive_allowed and self._wants_keep_alive(request)
+        headers[':path'] = path
+        headers[':query'] = request.query
         
-        if isinstance(message, dict):
-            response += json.dumps(message)
+        # Find the appropriate handler for the requested endpoint
+        route = self._find_route(method, path)
+        content_type = CONTENT_TYPE_JSON
+        response_headers = None
+        if route:
+            name, handler, streams_body = route
+            try:
+                result = handler(headers, None if streams_body else request.body)
+            except Exception as e:
+                print(f"Error in handler for {path}: {e}")
+                result = (500, {"error": f"Internal error: {str(e)}"})
+            status_code, message = result[0], result[1]
+            if len(result) > 2:
+                content_type = result[2]
+            if len(result) > 3:
+                response_headers = result[3]
+            if hasattr(message, 'finish'):
+                status_code, message = yield from self._pump_body(request, out, message)
+            elif streams_body:
+                keep_alive = False  # the unread body would be taken for the next request
         else:
-            response += message
-            
-        return response.encode()
+            name = path
+            status_code, message = 404, NOT_FOUND
+
+        if hasattr(message, 'write_event'):
+            keep_alive = False  # the event stream only ends when the connection does
+            yield from self._send_events(out, status_code, message, content_type)
+        elif hasattr(message, 'readinto'):
+            yield from out.send_stream(status_code, message, content_type, keep_alive,
+                                       response_headers)
+        else:
+            out.send(status_code, message, content_type, keep_alive, response_headers)
+        self.metrics.record(name, status_code, started)
+        return keep_alive
+
+    def _pump_body(self, request, out, sink):
+        """
+        Feeds a streamed request body into an upload sink through the
+        receive buffer; returns the sink's (status, message).
+        """
+        try:
+            if request.headers.get('expect', '').lower() == '100-continue':
+                out.write(CONTINUE)
+                out.flush()
+                yield None
+            chunk = request.buffered_body()
+            if len(chunk):
+                sink.write(chunk)
+            remaining = request.content_length - len(chunk)
+            while remaining > 0:
+                buf = request.body_buffer(remaining)
+                count = yield buf
+                if not count:
+                    raise OSError("Connection closed during upload")
+                sink.write(buf[:count])
+                remaining -= count
+        except BaseException:
+            sink.abort()
+            raise
+        return sink.finish()
+
+    def _send_events(self, out, status_code, events, content_type):
+        """
+        Writes server-sent events until the client disconnects or the
+        server stops. Each event is formatted into the writer's buffer and
+        flushed on its own; the loop sleeps events.interval_ms in between.
+        """
+        # A subscriber is capped by max_event_streams instead of holding one
+        # of max_connections for as long as the dashboard stays open
+        self.event_streams += 1
+        self.admission.release()
+        try:
+            out.start(status_code, UNTIL_CLOSE, content_type, False, _NO_CACHE)
+            out.flush()
+            yield None
+            while self.running:
+                events.write_event(out)
+                out.flush()
+                yield None
+                yield events.interval_ms
+        finally:
+            self.event_streams -= 1
+            self.admission.retain()  # the connection's own release() follows
+
+    def _wants_keep_alive(self, request):
+        """HTTP/1.1 connections persist unless the client asks to close them."""
+        connection = request.headers.get('connection', '').lower()
+        if request.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    def _defer(self, headers, action):
+        """Queues action to run once the current response has been sent."""
+        deferred = headers.get(':deferred')
+        if deferred is None:
+            deferred = headers[':deferred'] = []
+        deferred.append(action)
+
+    def _run_deferred(self, headers):
+        """Runs actions queued with _defer after the response is flushed."""
+        deferred = headers.pop(':deferred', None)
+        if deferred:
+            for action in deferred:
+                try:
+                    action()
+                except Exception as e:
+                    print(f"Deferred action failed: {e}")
+
+    def _query_param(self, headers, name):
+        """Returns the value of a query string parameter, or None."""
+        for pair in headers[':query'].split('&'):
+            equals = pair.find('=')
+            if equals > 0 and pair[:equals] == name:
+                return pair[equals + 1:]
+        return None
+
+    def _load_json(self, body):
+        """Decodes a JSON body; MicroPython reads the buffer in place, CPython needs bytes."""
+        try:
+            return json.loads(body)
+        except TypeError:
+            return json.loads(bytes(body))
     
     def handle_restart(self, headers, body):
         """Handler for the '/restart' endpoint."""
+        # Start restart process 2 seconds after the response has been sent
+        self._defer(headers, self._schedule_restart)
+        
+        # Send successful response
+        return 200, {"message": "Device will restart in 2 seconds"}
+    
+    def handle_metrics(self, headers, body):
+        """Handler for the '/metrics' endpoint (Prometheus text format)."""
+        return 200, self._render_metrics, CONTENT_TYPE_PROMETHEUS
+
+    def _render_metrics(self, stream):
+        self.metrics.render(stream)
+        self.admission.render(stream)
+        self.code_cache.render(stream)
+        if self.udp:
+            self.udp.render(stream)
+
+    def handle_events(self, headers, body):
+        """
+        Handler for the '/events' endpoint: streams telemetry (heap, CPU
+        frequency, WiFi RSSI, access point stations) as server-sent events.
+
+        Query: ?interval=<seconds> between events (default 5)
+        """
+        interval = self._query_param(headers, 'interval')
         try:
-            # Parse JSON data from body
-            data = json.loads(body)
-            
-            # Check API key
-            if 'api_key' not in data or data['api_key'] != self.api_key:
-                return self._create_response(401, {"error": "Unauthorized: Invalid API key"})
-            
-            # Send successful response
-            response = self._create_response(200, {"message": "Device will restart in 2 seconds"})
-            
-            # Start restart process after 2 seconds (to allow the response to be sent)
-            _thread.start_new_thread(self._delayed_restart, (2,))
-            
-            return response
-            
-        except json.JSONDecodeError:
-            return self._create_response(400, {"error": "Invalid JSON data"})
+            interval_ms = int(float(interval) * 1000) if interval else _EVENTS_DEFAULT_MS
+        except ValueError:
+            return 400, {"error": "Invalid interval"}
+        interval_ms = max(_EVENTS_MIN_MS, min(interval_ms, _EVENTS_MAX_MS))
+        if self.event_streams >= self.max_event_streams:
+            return 503, {"error": "Too many event streams"}, CONTENT_TYPE_JSON, _RETRY_AFTER
+        return 200, _EventStream(self.telemetry, interval_ms), CONTENT_TYPE_EVENT_STREAM
+
+    def handle_exec(self, headers, body):
+        """
+        Handler for the '/exec' endpoint: runs a Python snippet on the device.
+
+        Body: the source code (in /batch: {"code": "..."}). An expression
+        returns its value; statements return the value they assign to
+        'result'. Compiled code is cached by source hash.
+        """
+        if isinstance(body, dict):
+            body = body.get('code', '').encode()
+        try:
+            code, is_expression = self.code_cache.get(body)
+        except (SyntaxError, UnicodeError) as e:
+            return 400, {"error": f"Cannot compile: {str(e)}"}
+
+        namespace = {'__name__': '__exec__'}
+        try:
+            if is_expression:
+                value = eval(code, namespace)
+            else:
+                exec(code, namespace)
+                value = namespace.get('result')
         except Exception as e:
-            return self._create_response(500, {"error": f"Internal error: {str(e)}"})
-    
+            return 500, {"error": f"{type(e).__name__}: {str(e)}"}
+
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            value = repr(value)  # not JSON-serialisable; send its repr instead
+        return 200, {"result": value}
+
+    def handle_batch(self, headers, body):
+        """
+        Handler for the '/batch' endpoint.
+
+        Body: {"commands": [{"path": "/restart", "body": {...}}, ...]}
+        Runs each sub-command through the route table in order and returns
+        every result in one response.
+        """
+        try:
+            data = self._load_json(body)
+        except ValueError:
+            return 400, {"error": "Invalid JSON data"}
+        if not isinstance(data, dict):
+            return 400, {"error": "Expected a JSON object"}
+
+        commands = data.get('commands')
+        if not isinstance(commands, list):
+            return 400, {"error": "Expected a 'commands' list"}
+
+        # Sub-commands share the headers, so deferred actions (e.g. restart)
+        # are queued on this request and run after the combined response
+        results = []
+        for command in commands:
+            if isinstance(command, dict):
+                path, command_body = command.get('path'), command.get('body')
+            else:
+                path, command_body = None, None
+            status_code, value = self._run_command(headers, path, command_body or {})
+            results.append({"path": path, "status": status_code, "body": value})
+        return 200, {"results": results}
+
+    def _run_command(self, headers, path, body):
+        """
+        Runs the exact route for path outside an HTTP exchange (for /batch
+        and the UDP channel); returns (status, JSON-embeddable message).
+        """
+        route = self.routes.get(path)
+        if not route or path == '/batch':
+            return 404, "Not Found"
+        try:
+            result = route[1](headers, body)
+            return result[0], self._plain_message(result[1])
+        except Exception as e:
+            return 500, {"error": f"Internal error: {str(e)}"}
+
+    def _plain_message(self, message):
+        """Converts a handler message into a JSON-embeddable value."""
+        if isinstance(message, (dict, list, str)):
+            return message
+        if callable(message):
+            stream = io.StringIO()
+            message(stream)
+            return stream.getvalue()
+        if hasattr(message, 'write_event'):
+            raise ValueError("Event streams need an HTTP connection")
+        return bytes(message).decode()
+
+    def handle_fs_get(self, headers, body):
+        """
+        Handler for 'GET /fs/<path>': streams a file with chunked encoding
+        or lists a directory.
+        """
+        path = self._fs_path(headers)
+        try:
+            if os.stat(path)[0] & 0o170000 == 0o040000:
+                return 200, {"path": path, "entries": os.listdir(path)}
+            return 200, open(path, 'rb'), CONTENT_TYPE_OCTET
+        except OSError:
+            return 404, {"error": "File not found"}
+
+    def handle_fs_put(self, headers, body):
+        """
+        Handler for 'PUT /fs/<path>': writes the request body to a file as
+        it arrives. Requires Content-Length.
+        """
+        if 'content-length' not in headers:
+            return 411, {"error": "Content-Length required"}
+        path = self._fs_path(headers)
+        try:
+            return 200, _FileUpload(path, self._upload_blocks)
+        except OSError as e:
+            return 500, {"error": f"Cannot write {path}: {str(e)}"}
+
+    def handle_static(self, headers, body):
+        """
+        Handler for web UI assets under static_root: serves the .gz sibling
+        when the client accepts gzip and answers If-None-Match with 304.
+        """
+        entry = self.static.lookup(headers[':path'],
+                                   'gzip' in headers.get('accept-encoding', ''))
+        if entry is None:
+            return 404, NOT_FOUND
+        if_none_match = headers.get('if-none-match')
+        if if_none_match and self.static.not_modified(entry, if_none_match):
+            return 304, b'', None, entry.validators
+        try:
+            return 200, open(entry.path, 'rb'), entry.content_type, entry.headers
+        except OSError:
+            return 404, NOT_FOUND
+
+    def _fs_path(self, headers):
+        """Maps '/fs/<path>' to the absolute file system path."""
+        return headers[':path'][3:] or '/'
+
+    def _schedule_restart(self, delay_seconds=2):
+        """Schedules a restart without blocking the current request."""
+        if self.mode == "async":
+            restart = self._delayed_restart_async(delay_seconds)
+            try:
+                asyncio.create_task(restart)
+                return
+            except RuntimeError:
+                restart.close()  # called outside the event loop, e.g. from the UDP channel
+        _thread.start_new_thread(self._delayed_restart, (delay_seconds,))
+
     def _delayed_restart(self, delay_seconds):
         """Restarts ESP32 after a specified delay."""
         time.sleep(delay_seconds)
         machine.reset()
+
+    async def _delayed_restart_async(self, delay_seconds):
+        """Restarts ESP32 after a specified delay without blocking the event loop."""
+        await asyncio.sleep(delay_seconds)
+        machine.reset()
         
     def stop(self):
         """Stops the server."""
         self.running = False
         if self.server_socket:
             self.server_socket.close()
+        if self.udp:
+            self.udp.stop()
+
+
+class _FileUpload:
+    """
+    Upload sink that streams a request body to a temporary file, which
+    replaces the target only once the body is complete. Body chunks are
+    gathered in a block buffer taken from the server's pool and written in
+    whole blocks.
+    """
+
+    def __init__(self, path, blocks):
+        self.path = path
+        self.temp = path + TEMP_SUFFIX
+        self.file = open(self.temp, 'wb')
+        self.blocks = blocks
+        try:
+            self.block = blocks.pop()
+        except IndexError:
+            self.block = memoryview(bytearray(_UPLOAD_BLOCK_SIZE))
+        self.writer = BlockWriter(self.file, self.block)
+
+    def write(self, chunk):
+        self.writer.write(chunk)
+
+    def finish(self):
+        try:
+            self.writer.flush()
+        except OSError:
+            self.abort()
+            raise
+        self._close()
+        replace_file(self.temp, self.path)
+        invalidate_listing(self.path[:self.path.rfind('/')] or '/')
+        forget_digest(self.path)
+        return 200, {"path": self.path, "size": self.writer.size}
+
+    def abort(self):
+        """Closes and removes the partial file; the target is left untouched."""
+        self._close()
+        try:
+            os.remove(self.temp)
+        except OSError:
+            pass
+        invalidate_listing(self.path[:self.path.rfind('/')] or '/')
+
+    def _close(self):
+        self.file.close()
+        if self.block is not None:
+            self.blocks.append(self.block)
+            self.block = None
+
+
+class _EventStream:
+    """Response message for one /events subscriber."""
+
+    def __init__(self, source, interval_ms):
+        self.source = source
+        self.interval_ms = interval_ms
+
+    def write_event(self, out):
+        self.source.write_event(out)
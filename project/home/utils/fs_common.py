@@ -0,0 +1,48 @@
+"""
+File system helpers shared by the FTP server and the command server.
+
+Both servers write uploads to a temporary file that replaces the target
+once it is complete, and both must drop the FTP server's cached
+directory listing and the file's digest when they change a file. Keeping
+that here lets the command server do so without importing uftpd.
+"""
+
+import os
+
+# Uploads are written to <name>.part and renamed over <name> when complete
+TEMP_SUFFIX = ".part"
+
+# (directory, listing style) -> [(name, encoded listing line)], filled by uftpd
+listing_cache = {}
+# file path -> (size, mtime, SHA-256 hex), filled by uftpd for SITE MANIFEST
+digest_cache = {}
+
+
+def replace_file(src, dst):
+    """Renames src over dst; FAT refuses to overwrite, so dst is removed first there."""
+    try:
+        os.rename(src, dst)
+    except OSError:
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+def invalidate_listing(path):
+    """Drops the cached listings of a directory after its contents changed."""
+    for key in [key for key in listing_cache if key[0] == path]:
+        del listing_cache[key]
+
+
+def forget_digest(path, tree=False):
+    """
+    Drops the cached digest of a file that was written, removed or
+    renamed: mtime has a one second resolution, so a quick rewrite can
+    keep both size and mtime. Other files' digests stay, checked against
+    their size and mtime when used. tree also drops the digests below
+    path, for a renamed directory.
+    """
+    digest_cache.pop(path, None)
+    if tree:
+        prefix = path.rstrip('/') + '/'
+        for name in [name for name in digest_cache if name.startswith(prefix)]:
+            del digest_cache[name]
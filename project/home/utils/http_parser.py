@@ -0,0 +1,217 @@
+"""
+Incremental HTTP request parser for the command server.
+
+A parser owns one preallocated buffer. Socket data is read straight into
+it through a memoryview, the request line and headers are parsed from
+that buffer, and the body is handed out as a memoryview slice of it, so
+a request costs no intermediate receive strings. Bytes that follow the
+current request (pipelining) are kept for the next one.
+
+Once the headers are parsed the on_head callback sees the request. It
+can reject it (e.g. failed authentication) before any body byte is read,
+and it reports routes that accept bodies of any size (uploads): for
+those the request is ready once its headers are in, and the caller pumps
+the body through the same buffer.
+"""
+
+from micropython import const
+
+_HEADER_END = b'\r\n\r\n'
+_CRLF = b'\r\n'
+
+# Searches buffer[start:end] in place; builds without bytearray.find
+# scan a copy of just that range
+if hasattr(bytearray, 'find'):
+    def _find(buffer, sub, start, end):
+        return buffer.find(sub, start, end)
+else:
+    def _find(buffer, sub, start, end):
+        index = bytes(memoryview(buffer)[start:end]).find(sub)
+        return index + start if index >= 0 else -1
+
+# Default limits
+_BUFFER_SIZE = const(4096)
+_MAX_HEADER_SIZE = const(1024)
+
+
+class RequestError(Exception):
+    """Raised for requests that must be rejected with the given HTTP status."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers
+
+
+class RequestParser:
+    def __init__(self, buffer_size=_BUFFER_SIZE, max_header_size=_MAX_HEADER_SIZE,
+                 on_head=None):
+        """
+        Creates a parser with a reusable receive buffer.
+
+        Args:
+            buffer_size (int): Size of the receive buffer (headers + body)
+            max_header_size (int): Largest accepted request line + headers
+            on_head (callable): on_head(parser) is called once the headers are
+                parsed; it may raise RequestError to reject the request and
+                returns True if the body is streamed instead of buffered
+        """
+        self.buffer = bytearray(buffer_size)
+        self.mv = memoryview(self.buffer)
+        self.max_header_size = min(max_header_size, buffer_size)
+        self.on_head = on_head
+        self.reset()
+
+    def reset(self):
+        """Drops all buffered data, e.g. before reusing the parser for a new connection."""
+        self.filled = 0
+        self._clear()
+
+    def _clear(self):
+        """Forgets the parsed request while keeping the buffered bytes."""
+        self._scanned = 0
+        self.header_end = -1
+        self.method = None
+        self.path = None
+        self.query = ''
+        self.version = None
+        self.headers = None
+        self.content_length = 0
+        self.streaming = False
+
+    def free(self):
+        """Returns the writable tail of the buffer for the next readinto()."""
+        return self.mv[self.filled:]
+
+    def feed(self, count):
+        """
+        Accounts for count bytes read into free() and parses the header
+        block as soon as it is complete.
+
+        Raises:
+            RequestError: 431 if the headers are too large, 413 if the
+                declared body does not fit the buffer, 400 if malformed,
+                or whatever on_head rejects the request with
+        """
+        self.filled += count
+        if self.header_end >= 0:
+            return
+
+        # Only rescan the new bytes (plus 3 in case the terminator was split)
+        start = self._scanned - 3 if self._scanned > 3 else 0
+        index = _find(self.buffer, _HEADER_END, start, self.filled)
+        if index < 0:
+            self._scanned = self.filled
+            if self.filled >= self.max_header_size:
+                raise RequestError(431, "Request header fields too large")
+            return
+
+        self.header_end = index
+        if self.header_end > self.max_header_size:
+            raise RequestError(431, "Request header fields too large")
+        self._parse_head()
+        if self.on_head is not None:
+            self.streaming = self.on_head(self)
+        if not self.streaming and self.body_start + self.content_length > len(self.buffer):
+            raise RequestError(413, "Payload too large")
+
+    def complete(self):
+        """True once the headers and the whole body (unless streamed) are in the buffer."""
+        return (self.header_end >= 0 and
+                (self.streaming or self.filled >= self.body_start + self.content_length))
+
+    @property
+    def body_start(self):
+        return self.header_end + 4
+
+    @property
+    def body(self):
+        """The request body as a memoryview into the receive buffer."""
+        start = self.body_start
+        return self.mv[start:start + self.content_length]
+
+    def buffered_body(self):
+        """The part of a streamed body that arrived together with the headers."""
+        start = self.body_start
+        end = start + self.content_length
+        return self.mv[start:end if end < self.filled else self.filled]
+
+    def body_buffer(self, remaining):
+        """
+        Returns the buffer to read the rest of a streamed body into.
+
+        Only valid after buffered_body() has been consumed; the headers
+        are already parsed, so the whole buffer can be reused.
+        """
+        self.filled = self.body_start + self.content_length  # nothing left after the body
+        return self.mv[:remaining if remaining < len(self.buffer) else len(self.buffer)]
+
+    def consume(self):
+        """
+        Discards the current request, moving any pipelined bytes that
+        follow it to the front of the buffer and parsing them if complete.
+        """
+        end = self.body_start + self.content_length
+        remaining = self.filled - end
+        if remaining > 0:
+            self.buffer[:remaining] = self.mv[end:self.filled]
+        self.filled = remaining if remaining > 0 else 0
+        self._clear()
+        if self.filled:
+            self.feed(0)
+
+    def _text(self, start, end):
+        return bytes(self.mv[start:end]).decode()
+
+    def _parse_head(self):
+        """
+        Parses the request line and headers out of the buffer by offset;
+        only the method, target, version and each header name and value
+        are copied out.
+        """
+        buffer = self.buffer
+        end = self.header_end
+        line_end = _find(buffer, _CRLF, 0, end)
+        if line_end < 0:
+            line_end = end
+        method_end = _find(buffer, b' ', 0, line_end)
+        if method_end <= 0:
+            raise RequestError(400, "Malformed request line")
+        target_end = _find(buffer, b' ', method_end + 1, line_end)
+        if target_end < 0:
+            target_end = line_end
+        if target_end == method_end + 1:
+            raise RequestError(400, "Malformed request line")
+        query_start = _find(buffer, b'?', method_end + 1, target_end)
+        try:
+            self.method = self._text(0, method_end)
+            if query_start >= 0:
+                self.path = self._text(method_end + 1, query_start)
+                self.query = self._text(query_start + 1, target_end)
+            else:
+                self.path = self._text(method_end + 1, target_end)
+            self.version = (self._text(target_end + 1, line_end) if target_end < line_end
+                            else 'HTTP/1.0')
+
+            headers = {}
+            start = line_end + 2
+            while start < end:
+                line_end = _find(buffer, _CRLF, start, end)
+                if line_end < 0:
+                    line_end = end
+                colon = _find(buffer, b':', start, line_end)
+                if colon > start:
+                    headers[self._text(start, colon).strip().lower()] = (
+                        self._text(colon + 1, line_end).strip())
+                start = line_end + 2
+        except UnicodeError:
+            raise RequestError(400, "Malformed request")
+        self.headers = headers
+
+        try:
+            self.content_length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise RequestError(400, "Invalid Content-Length")
+        if self.content_length < 0:
+            raise RequestError(400, "Invalid Content-Length")
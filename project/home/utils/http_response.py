@@ -0,0 +1,322 @@
+"""
+Allocation-free HTTP response writer for the command server.
+
+Status lines and common headers are encoded once at import time. A
+ResponseWriter copies them, the Content-Length digits and the body into
+one fixed output buffer that is flushed to the socket as it fills, so a
+reply never builds an intermediate string. JSON bodies are serialized
+once with json.dump into the buffer behind the headers; bodies too large
+for it, and rendered text such as /metrics, go out with chunked encoding.
+"""
+
+import io
+import json
+import sys
+from micropython import const
+
+_OUT_SIZE = const(512)
+# Chunk size line: 4 hex digits + CRLF, reserved ahead of each chunk's data
+_CHUNK_HEAD = const(6)
+
+STATUS_LINES = {
+    200: b'HTTP/1.1 200 OK\r\n',
+    304: b'HTTP/1.1 304 Not Modified\r\n',
+    400: b'HTTP/1.1 400 Bad Request\r\n',
+    401: b'HTTP/1.1 401 Unauthorized\r\n',
+    404: b'HTTP/1.1 404 Not Found\r\n',
+    411: b'HTTP/1.1 411 Length Required\r\n',
+    413: b'HTTP/1.1 413 Payload Too Large\r\n',
+    431: b'HTTP/1.1 431 Request Header Fields Too Large\r\n',
+    500: b'HTTP/1.1 500 Internal Server Error\r\n',
+    503: b'HTTP/1.1 503 Service Unavailable\r\n',
+}
+_STATUS_UNKNOWN = b'HTTP/1.1 500 Unknown\r\n'
+
+CONTENT_TYPE_JSON = b'Content-Type: application/json\r\n'
+CONTENT_TYPE_TEXT = b'Content-Type: text/plain\r\n'
+CONTENT_TYPE_PROMETHEUS = b'Content-Type: text/plain; version=0.0.4\r\n'
+CONTENT_TYPE_OCTET = b'Content-Type: application/octet-stream\r\n'
+CONTENT_TYPE_EVENT_STREAM = b'Content-Type: text/event-stream\r\n'
+_CONTENT_LENGTH = b'Content-Length: '
+_TRANSFER_CHUNKED = b'Transfer-Encoding: chunked\r\n'
+_LAST_CHUNK = b'0\r\n\r\n'
+_CONNECTION_KEEP_ALIVE = b'Connection: keep-alive\r\n\r\n'
+_CONNECTION_CLOSE = b'Connection: close\r\n\r\n'
+_CRLF = b'\r\n'
+
+NOT_FOUND = b'Not Found'
+
+# start() length for a body that runs until the connection is closed
+UNTIL_CLOSE = const(-1)
+
+# Interim reply for clients that send "Expect: 100-continue" before a body
+CONTINUE = b'HTTP/1.1 100 Continue\r\n\r\n'
+
+# Complete canned reply for shedding load before a request is parsed
+SERVICE_UNAVAILABLE = (STATUS_LINES[503] + CONTENT_TYPE_JSON +
+                       b'Retry-After: 1\r\nContent-Length: 25\r\n' + _CONNECTION_CLOSE +
+                       b'{"error": "Server busy"}\n')
+
+
+if sys.implementation.name == 'micropython':
+    _dump = json.dump
+else:  # CPython (host benchmarks): json.dump to a stream uses the pure-Python encoder
+    def _dump(obj, stream):
+        stream.write(json.dumps(obj))
+
+
+class _Overflow(Exception):
+    """Raised by a capturing ResponseWriter when the body outgrows its buffer."""
+
+
+class ResponseWriter(io.IOBase):
+    def __init__(self, size=_OUT_SIZE):
+        """
+        Creates a writer with a fixed output buffer.
+
+        Args:
+            size (int): Output buffer size; larger writes fill it, then
+                bypass it
+        """
+        self.buffer = bytearray(size)
+        self.mv = memoryview(self.buffer)
+        self.pos = 0
+        self.limit = size
+        self.chunk = -1  # start of the open chunk's size line, -1 if not chunked
+        self.capture = False  # raise _Overflow instead of flushing
+        self.sink = None
+
+    def attach(self, sink):
+        """Sets the write function (socket sendall or stream write) to flush into."""
+        self.sink = sink
+        self.pos = 0
+        self.limit = len(self.buffer)
+        self.chunk = -1
+
+    def write(self, data):
+        """Buffers data (bytes-like, or str from CPython's json.dump)."""
+        if isinstance(data, str):
+            data = data.encode()
+        size = len(data)
+        room = self.limit - self.pos
+        if size > room:
+            if self.capture:
+                raise _Overflow()
+            # Top the buffer up before flushing, so the headers leave in the
+            # same send as the start of the body; a headers-only send
+            # followed by the body stalls on Nagle + delayed ACK
+            data = memoryview(data)
+            while len(data) > room:
+                self.buffer[self.pos:self.limit] = data[:room]
+                self.pos += room
+                self.flush()
+                data = data[room:]
+                if self.chunk < 0 and len(data) > len(self.buffer):
+                    self.sink(data)
+                    return size
+                room = self.limit - self.pos
+        count = len(data)
+        self.buffer[self.pos:self.pos + count] = data
+        self.pos += count
+        return size
+
+    def write_int(self, value):
+        """Writes an integer as ASCII digits without creating a str."""
+        if self.pos + 11 > self.limit:
+            self.flush()
+        if value < 0:
+            self.buffer[self.pos] = 45  # '-'
+            self.pos += 1
+            value = -value
+        start = self.pos
+        while True:
+            self.buffer[self.pos] = 48 + value % 10
+            self.pos += 1
+            value //= 10
+            if not value:
+                break
+        # Digits were written least significant first
+        end = self.pos - 1
+        while start < end:
+            self.buffer[start], self.buffer[end] = self.buffer[end], self.buffer[start]
+            start += 1
+            end -= 1
+
+    def flush(self):
+        """Sends everything buffered so far."""
+        if self.chunk >= 0:
+            self._close_chunk()
+            if self.pos:
+                self.sink(self.mv[:self.pos])
+            # the next chunk starts at the front of the buffer
+            self.chunk = 0
+            self.pos = _CHUNK_HEAD
+        elif self.pos:
+            self.sink(self.mv[:self.pos])
+            self.pos = 0
+
+    def begin_chunks(self):
+        """
+        Switches to chunked transfer encoding after start(length=None):
+        everything written until end_chunks() is framed as chunks, one per
+        buffer flush.
+        """
+        if self.pos + _CHUNK_HEAD + 2 > len(self.buffer):
+            self.flush()
+        self.chunk = self.pos
+        self.pos += _CHUNK_HEAD
+        self.limit = len(self.buffer) - 2  # room for the chunk's closing CRLF
+
+    def end_chunks(self):
+        """Closes the last chunk, writes the terminating chunk and flushes."""
+        self._close_chunk()
+        self.chunk = -1
+        self.limit = len(self.buffer)
+        self.write(_LAST_CHUNK)
+        self.flush()
+
+    def _close_chunk(self):
+        """Fills in the open chunk's size line and CRLF, or drops it if empty."""
+        count = self.pos - self.chunk - _CHUNK_HEAD
+        if not count:
+            self.pos = self.chunk
+            return
+        buffer, start = self.buffer, self.chunk
+        for i in range(4):
+            digit = (count >> (12 - 4 * i)) & 0xF
+            buffer[start + i] = digit + (48 if digit < 10 else 87)
+        buffer[start + 4:start + 6] = _CRLF
+        buffer[self.pos:self.pos + 2] = _CRLF
+        self.pos += 2
+
+    def start(self, status_code, length, content_type=CONTENT_TYPE_JSON,
+              keep_alive=False, headers=None):
+        """
+        Writes the status line and headers.
+
+        Args:
+            status_code (int): HTTP status code
+            length (int): Body length for Content-Length, None for chunked,
+                UNTIL_CLOSE for a body that ends when the connection closes
+            content_type (bytes): Pre-encoded Content-Type header line, or None
+            keep_alive (bool): Whether the connection stays open
+            headers (tuple): Extra pre-encoded header lines
+        """
+        self.write(STATUS_LINES.get(status_code, _STATUS_UNKNOWN))
+        if content_type is not None:
+            self.write(content_type)
+        if headers:
+            for header in headers:
+                self.write(header)
+        if length is None:
+            self.write(_TRANSFER_CHUNKED)
+        elif length != UNTIL_CLOSE:
+            self.write(_CONTENT_LENGTH)
+            self.write_int(length)
+            self.write(_CRLF)
+        self.write(_CONNECTION_KEEP_ALIVE if keep_alive else _CONNECTION_CLOSE)
+
+    def send(self, status_code, message, content_type=CONTENT_TYPE_JSON,
+             keep_alive=False, headers=None):
+        """
+        Writes a complete response and flushes it.
+
+        Args:
+            message: dict/list (serialized once; see _send_json), a render(stream) callable
+                (called once, sent with chunked encoding), or a bytes-like
+                or str body
+        """
+        if status_code == 304:
+            # No body, and no Content-Length: on a 304 it would have to
+            # equal the length of the 200 (RFC 9110, 8.6)
+            self.start(status_code, UNTIL_CLOSE, content_type, keep_alive, headers)
+        elif isinstance(message, (dict, list)):
+            self._send_json(status_code, message, content_type, keep_alive, headers)
+            return
+        elif callable(message):
+            # Rendered once: values such as uptime or counters bumped by
+            # other connections would change between a measuring pass and
+            # a writing pass, and the Content-Length with them
+            self.start(status_code, None, content_type, keep_alive, headers)
+            self.begin_chunks()
+            message(self)
+            self.end_chunks()
+        else:
+            if isinstance(message, str):
+                message = message.encode()
+            self.start(status_code, len(message), content_type, keep_alive, headers)
+            self.write(message)
+        self.flush()
+
+    def _send_json(self, status_code, message, content_type, keep_alive, headers):
+        """
+        Serializes message once, straight into the buffer behind room left
+        for the headers, then writes the headers ahead of it now that the
+        Content-Length is known, and sends both at once. A body that does
+        not fit is serialized again with chunked encoding.
+        """
+        self.flush()
+        connection = _CONNECTION_KEEP_ALIVE if keep_alive else _CONNECTION_CLOSE
+        # header bytes with a 5 digit Content-Length
+        head = (len(STATUS_LINES.get(status_code, _STATUS_UNKNOWN)) + len(content_type) +
+                len(_CONTENT_LENGTH) + 5 + len(_CRLF) + len(connection))
+        if headers:
+            for header in headers:
+                head += len(header)
+        if head + 11 <= len(self.buffer):  # write_int needs 11 bytes of room
+            self.pos = head
+            self.capture = True
+            try:
+                _dump(message, self)
+                length = self.pos - head
+            except _Overflow:
+                length = -1
+            self.capture = False
+            if length >= 0:
+                digits = 1
+                while length >= 10 ** digits:
+                    digits += 1
+                self.pos = 5 - digits
+                start = self.pos
+                self.start(status_code, length, content_type, keep_alive, headers)
+                self.sink(self.mv[start:head + length])
+                self.pos = 0
+                return
+            self.pos = 0
+        self.start(status_code, None, content_type, keep_alive, headers)
+        self.begin_chunks()
+        _dump(message, self)
+        self.end_chunks()
+
+    def send_stream(self, status_code, source, content_type=CONTENT_TYPE_OCTET,
+                    keep_alive=False, headers=None):
+        """
+        Sends everything readable from source with chunked transfer encoding.
+
+        Each chunk is read straight into the output buffer behind a
+        fixed-width size line, so the data is never copied. This is a
+        generator that yields after every write so async callers can
+        drain; source is closed when it is exhausted.
+        """
+        try:
+            self.start(status_code, None, content_type, keep_alive, headers)
+            self.flush()
+            yield None
+
+            buffer, mv = self.buffer, self.mv
+            # 4 hex digits + CRLF before the data, CRLF after it
+            limit = min(len(buffer) - 8, 0xFFFF)
+            while True:
+                count = source.readinto(mv[6:6 + limit])
+                if not count:
+                    break
+                for i in range(4):
+                    digit = (count >> (12 - 4 * i)) & 0xF
+                    buffer[i] = digit + (48 if digit < 10 else 87)
+                buffer[4:6] = _CRLF
+                buffer[6 + count:8 + count] = _CRLF
+                self.sink(mv[:8 + count])
+                yield None
+            self.sink(_LAST_CHUNK)
+        finally:
+            source.close()
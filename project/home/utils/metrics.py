@@ -0,0 +1,141 @@
+"""
+Request metrics for the command server in Prometheus text format.
+
+All counters live in arrays allocated when the server is created, and
+record() only does index arithmetic on small ints, so counting a request
+does not touch the heap. Text is only produced when /metrics is scraped.
+"""
+
+import gc
+import time
+from array import array
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:  # CPython (host benchmarks)
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(end, start):
+        return end - start
+
+try:
+    import esp32
+except ImportError:
+    esp32 = None
+
+# Status codes with their own counter; anything else is counted as "other"
+STATUSES = (200, 304, 400, 401, 404, 413, 431, 500, 503)
+# Latency bucket upper bounds in microseconds (+Inf is implicit)
+BUCKETS_US = (1000, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000, 2500000)
+
+OTHER_ROUTE = "other"
+
+
+class Metrics:
+    def __init__(self, routes):
+        """
+        Preallocates counters for a fixed set of routes.
+
+        Args:
+            routes: Route names; requests to unknown paths count as "other"
+        """
+        self.routes = tuple(routes) + (OTHER_ROUTE,)
+        self._index = {}
+        for i, route in enumerate(self.routes):
+            self._index[route] = i
+        statuses = len(STATUSES) + 1
+        buckets = len(BUCKETS_US) + 1
+        self.requests = array('I', [0] * (len(self.routes) * statuses))
+        self.latency_buckets = array('I', [0] * (len(self.routes) * buckets))
+        # Latency sum kept as ms + sub-ms remainder so it stays a small int
+        self.latency_sum_ms = array('I', [0] * len(self.routes))
+        self.latency_sum_rem_us = array('I', [0] * len(self.routes))
+        self.started = time.time()
+
+    def route_index(self, route):
+        """Returns the counter index for a route name."""
+        return self._index.get(route, len(self.routes) - 1)
+
+    def record(self, route, status_code, started_us):
+        """Counts one finished request; started_us is a ticks_us() timestamp."""
+        elapsed = ticks_diff(ticks_us(), started_us)
+        route_i = self.route_index(route)
+
+        status_i = len(STATUSES)
+        for i in range(len(STATUSES)):
+            if STATUSES[i] == status_code:
+                status_i = i
+                break
+        self.requests[route_i * (len(STATUSES) + 1) + status_i] += 1
+
+        bucket_i = len(BUCKETS_US)
+        for i in range(len(BUCKETS_US)):
+            if elapsed <= BUCKETS_US[i]:
+                bucket_i = i
+                break
+        self.latency_buckets[route_i * (len(BUCKETS_US) + 1) + bucket_i] += 1
+        elapsed += self.latency_sum_rem_us[route_i]
+        self.latency_sum_ms[route_i] += elapsed // 1000
+        self.latency_sum_rem_us[route_i] = elapsed % 1000
+
+    def heap(self):
+        """Returns (free, allocated, largest free block) heap sizes in bytes."""
+        largest = 0
+        if esp32 is not None:
+            try:
+                for region in esp32.idf_heap_info(esp32.HEAP_DATA):
+                    if region[2] > largest:
+                        largest = region[2]
+            except Exception:
+                pass
+        try:
+            return gc.mem_free(), gc.mem_alloc(), largest
+        except AttributeError:  # CPython has no heap statistics
+            return 0, 0, largest
+
+    def render(self, stream):
+        """Writes all metrics to stream in Prometheus text exposition format."""
+        write = stream.write
+        statuses = len(STATUSES) + 1
+        buckets = len(BUCKETS_US) + 1
+
+        write("# HELP http_requests_total Requests handled, by route and status.\n")
+        write("# TYPE http_requests_total counter\n")
+        for route_i, route in enumerate(self.routes):
+            for status_i in range(statuses):
+                count = self.requests[route_i * statuses + status_i]
+                if count:
+                    status = STATUSES[status_i] if status_i < len(STATUSES) else "other"
+                    write(f'http_requests_total{{route="{route}",status="{status}"}} {count}\n')
+
+        write("# HELP http_request_duration_seconds Time to handle a request.\n")
+        write("# TYPE http_request_duration_seconds histogram\n")
+        for route_i, route in enumerate(self.routes):
+            base = route_i * buckets
+            total = 0
+            for bucket_i in range(buckets):
+                total += self.latency_buckets[base + bucket_i]
+            if not total:
+                continue
+            cumulative = 0
+            for bucket_i in range(buckets):
+                cumulative += self.latency_buckets[base + bucket_i]
+                le = BUCKETS_US[bucket_i] / 1_000_000 if bucket_i < len(BUCKETS_US) else "+Inf"
+                write(f'http_request_duration_seconds_bucket{{route="{route}",le="{le}"}} {cumulative}\n')
+            write(f'http_request_duration_seconds_sum{{route="{route}"}} {self.latency_sum_ms[route_i] / 1000 + self.latency_sum_rem_us[route_i] / 1_000_000}\n')
+            write(f'http_request_duration_seconds_count{{route="{route}"}} {total}\n')
+
+        free, allocated, largest = self.heap()
+        write("# HELP heap_free_bytes Free MicroPython heap.\n")
+        write("# TYPE heap_free_bytes gauge\n")
+        write(f"heap_free_bytes {free}\n")
+        write("# HELP heap_alloc_bytes Allocated MicroPython heap.\n")
+        write("# TYPE heap_alloc_bytes gauge\n")
+        write(f"heap_alloc_bytes {allocated}\n")
+        write("# HELP heap_largest_free_block_bytes Largest free block in the IDF data heap.\n")
+        write("# TYPE heap_largest_free_block_bytes gauge\n")
+        write(f"heap_largest_free_block_bytes {largest}\n")
+        write("# HELP process_uptime_seconds Seconds since the command server started.\n")
+        write("# TYPE process_uptime_seconds gauge\n")
+        write(f"process_uptime_seconds {time.time() - self.started}\n")
@@ -0,0 +1,119 @@
+"""
+Static file lookup for the command server's web UI mode.
+
+For every requested path the resolved file (the .gz sibling when the
+client accepts gzip), its ETag and the pre-encoded response headers are
+cached, so a repeat request costs one os.stat() to revalidate the entry
+and, if the client's copy is current, no file read at all.
+"""
+
+import os
+
+_TYPES = {
+    'html': b'Content-Type: text/html\r\n',
+    'css': b'Content-Type: text/css\r\n',
+    'js': b'Content-Type: application/javascript\r\n',
+    'json': b'Content-Type: application/json\r\n',
+    'svg': b'Content-Type: image/svg+xml\r\n',
+    'png': b'Content-Type: image/png\r\n',
+    'jpg': b'Content-Type: image/jpeg\r\n',
+    'ico': b'Content-Type: image/x-icon\r\n',
+    'txt': b'Content-Type: text/plain\r\n',
+}
+_TYPE_DEFAULT = b'Content-Type: application/octet-stream\r\n'
+
+_GZIP = b'Content-Encoding: gzip\r\n'
+_VARY = b'Vary: Accept-Encoding\r\n'
+# HTML is always revalidated (a cheap 304) so UI updates show up at once
+_NO_CACHE = b'Cache-Control: no-cache\r\n'
+
+
+class StaticEntry:
+    """A resolved static file with its validators and response headers."""
+
+    def __init__(self, path, size, mtime, content_type, headers, etag, validators):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.content_type = content_type
+        self.headers = headers
+        self.etag = etag
+        # headers of a 304: the 200's headers without Content-Encoding
+        self.validators = validators
+
+
+class StaticFiles:
+    def __init__(self, root, max_age=86400, cache_size=16):
+        """
+        Serves files below root.
+
+        Args:
+            root (str): Directory holding the web UI
+            max_age (int): Cache-Control max-age in seconds for non-HTML assets
+            cache_size (int): Number of resolved paths kept
+        """
+        self.root = root.rstrip('/')
+        self.cache_control = b'Cache-Control: public, max-age=' + str(max_age).encode() + b'\r\n'
+        self.cache_size = cache_size
+        self._entries = {}
+
+    def lookup(self, path, gzip):
+        """
+        Returns the StaticEntry for a request path, or None if there is
+        no such file. gzip tells whether the client accepts gzip.
+        """
+        if '..' in path:
+            return None
+        if path.endswith('/'):
+            path += 'index.html'
+        key = path + '|gz' if gzip else path
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            try:
+                stat = os.stat(entry.path)
+                if stat[6] == entry.size and stat[8] == entry.mtime:
+                    return entry
+            except OSError:
+                pass
+            del self._entries[key]  # changed or removed since it was cached
+
+        entry = self._resolve(path, gzip)
+        if entry is not None:
+            if len(self._entries) >= self.cache_size:
+                self._entries.popitem()
+            self._entries[key] = entry
+        return entry
+
+    def _resolve(self, path, gzip):
+        """Finds the file to send for path and builds its headers."""
+        file_path = self.root + path
+        headers = [_VARY]
+        stat = None
+        if gzip:
+            try:
+                stat = os.stat(file_path + '.gz')
+                file_path += '.gz'
+                headers.append(_GZIP)
+            except OSError:
+                pass
+        if stat is None:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return None
+        if stat[0] & 0o170000 == 0o040000:
+            return None  # directory without a trailing slash
+
+        size, mtime = stat[6], stat[8]
+        etag = f'"{size:x}-{mtime:x}"'
+        headers.append(b'ETag: ' + etag.encode() + b'\r\n')
+        extension = path[path.rfind('.') + 1:] if '.' in path else ''
+        headers.append(_NO_CACHE if extension == 'html' else self.cache_control)
+        return StaticEntry(file_path, size, mtime, _TYPES.get(extension, _TYPE_DEFAULT),
+                           tuple(headers), etag,
+                           tuple(header for header in headers if header is not _GZIP))
+
+    def not_modified(self, entry, if_none_match):
+        """True if the client's If-None-Match header matches entry's ETag."""
+        return if_none_match == '*' or entry.etag in if_none_match
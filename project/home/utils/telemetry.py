@@ -0,0 +1,57 @@
+"""
+Live device telemetry for the command server's /events stream.
+
+Each reading is written as one server-sent event straight into the
+connection's preallocated response buffer; numbers are written as
+digits in place, so a frame builds no strings.
+"""
+
+import gc
+import machine
+import network
+
+
+class Telemetry:
+    def __init__(self):
+        self.sta = network.WLAN(network.STA_IF)
+        self.ap = network.WLAN(network.AP_IF)
+
+    def rssi(self):
+        """Signal strength of the WiFi connection in dBm, or None when not connected."""
+        try:
+            if self.sta.isconnected():
+                return self.sta.status('rssi')
+        except Exception:
+            pass
+        return None
+
+    def stations(self):
+        """Number of clients connected to the access point."""
+        try:
+            if self.ap.active():
+                return len(self.ap.status('stations'))
+        except Exception:
+            pass
+        return 0
+
+    def write_event(self, out):
+        """Writes one 'telemetry' event with the current readings to out."""
+        try:
+            free, allocated = gc.mem_free(), gc.mem_alloc()
+        except AttributeError:  # CPython has no heap statistics
+            free = allocated = 0
+        out.write(b'event: telemetry\ndata: {"heap_free": ')
+        out.write_int(free)
+        out.write(b', "heap_alloc": ')
+        out.write_int(allocated)
+        out.write(b', "cpu_freq": ')
+        out.write_int(machine.freq())
+        out.write(b', "rssi": ')
+        rssi = self.rssi()
+        if rssi is None:
+            out.write(b'null')
+        else:
+            out.write_int(rssi)
+        out.write(b', "stations": ')
+        out.write_int(self.stations())
+        out.write(b'}\n\n')
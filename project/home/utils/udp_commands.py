@@ -0,0 +1,236 @@
+"""
+Authenticated UDP command channel for the command server.
+
+One datagram carries one command and gets one datagram back, so a
+controller can reach a whole fleet with a single broadcast packet
+instead of a TCP connection per device.
+
+Datagram layout (request and reply):
+
+    nonce    8 bytes   big-endian counter, strictly increasing per key
+    tag     32 bytes   HMAC-SHA256(api_key, nonce + payload)
+    payload            request: b'<path>[ <json body>]'
+                       reply:   b'<status> <json message>'
+
+The reply echoes the request nonce and is signed with the same key.
+Datagrams with a bad tag, a nonce not above the last one accepted, or
+over the source IP's rate limit are dropped silently. The tag does not
+cover the sender's address and every controller signs with the same API
+key, so the device keeps one high-water nonce for the key, not one per
+sender: a datagram resent from another address is still a replay.
+Controllers should use a millisecond timestamp as the nonce so it keeps
+increasing across their restarts and between controllers.
+
+The high-water mark survives the device's restarts, so a captured
+datagram (say a signed /restart) cannot be replayed after each boot.
+Writing every nonce to flash would wear it out, so the channel reserves
+nonces ahead instead: when an accepted nonce reaches the stored mark, it
+writes nonce + nonce_lease first, and after a restart everything up to
+the stored mark is refused. At most one write happens per nonce_lease
+(10 s of timestamp nonces); commands in the lease that was open when
+the device restarted are refused until the controller's clock passes it.
+"""
+
+import hashlib
+import json
+import socket
+import _thread
+from micropython import const
+from home.utils.metrics import ticks_us
+from home.utils.fs_common import replace_file, TEMP_SUFFIX
+
+_DATAGRAM_SIZE = const(512)
+_NONCE_SIZE = const(8)
+_HEADER_SIZE = const(40)  # nonce + 32-byte tag
+_NONCE_LEASE = const(10000)  # nonces reserved per flash write
+_NONCE_MAX = (1 << 64) - 1
+
+
+def _pads(key):
+    """Returns the HMAC-SHA256 inner and outer key pads."""
+    if isinstance(key, str):
+        key = key.encode()
+    if len(key) > 64:
+        key = hashlib.sha256(key).digest()
+    key = key + bytes(64 - len(key))
+    return bytes(b ^ 0x36 for b in key), bytes(b ^ 0x5C for b in key)
+
+
+def _hmac(pads, *parts):
+    """HMAC-SHA256 over the concatenation of parts (hashlib has no hmac on MicroPython)."""
+    inner = hashlib.sha256(pads[0])
+    for part in parts:
+        inner.update(part)
+    outer = hashlib.sha256(pads[1])
+    outer.update(inner.digest())
+    return outer.digest()
+
+
+def _tags_equal(a, b):
+    """Compares two tags in constant time."""
+    if len(a) != len(b):
+        return False
+    diff = 0
+    for i in range(len(a)):
+        diff |= a[i] ^ b[i]
+    return diff == 0
+
+
+def pack_command(key, nonce, path, body=None):
+    """
+    Builds a command datagram (for controllers, runs on CPython too).
+
+    Args:
+        key (str): The command server's API key
+        nonce (int): Increasing counter, e.g. a millisecond timestamp
+        path (str): Route to run, e.g. "/restart"
+        body (dict): Optional JSON body for the route
+    """
+    payload = path.encode()
+    if body is not None:
+        payload += b' ' + json.dumps(body).encode()
+    nonce = nonce.to_bytes(_NONCE_SIZE, 'big')
+    return nonce + _hmac(_pads(key), nonce, payload) + payload
+
+
+def unpack_reply(key, datagram):
+    """
+    Verifies a reply datagram; returns (nonce, status, message) or None if
+    the tag does not match.
+    """
+    nonce, tag, payload = (datagram[:_NONCE_SIZE], datagram[_NONCE_SIZE:_HEADER_SIZE],
+                           datagram[_HEADER_SIZE:])
+    if not _tags_equal(tag, _hmac(_pads(key), nonce, payload)):
+        return None
+    payload = bytes(payload)
+    space = payload.find(b' ')
+    return (int.from_bytes(nonce, 'big'), int(payload[:space]),
+            json.loads(payload[space + 1:]))
+
+
+class UdpCommandChannel:
+    def __init__(self, server, port=8081, nonce_file="/udp_nonce",
+                 nonce_lease=_NONCE_LEASE):
+        """
+        Serves the command server's exact routes over UDP.
+
+        Args:
+            server: The CommandServer whose routes, API key, rate limit and
+                metrics are used
+            port (int): UDP port to listen on (also receives broadcasts)
+            nonce_file (str): Where the reserved high-water nonce is kept
+                across restarts
+            nonce_lease (int): Nonces reserved ahead by each write of
+                nonce_file
+        """
+        self.server = server
+        self.port = port
+        self.sock = None
+        self.running = False
+        self._pads = _pads(server.api_key)
+        self.nonce_file = nonce_file
+        self.nonce_lease = nonce_lease
+        # Nonces up to the stored reservation may have been accepted
+        # before a restart; see _advance
+        self._reserved = self._load_reserved()
+        self._nonce = self._reserved  # highest nonce accepted (or reserved)
+        self.dropped = 0
+
+    def start(self):
+        """Binds the socket and serves datagrams from a background thread."""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(socket.getaddrinfo('0.0.0.0', self.port)[0][-1])
+        self.running = True
+        _thread.start_new_thread(self._loop, ())
+        print(f"UDP command channel listening on port {self.port}")
+
+    def stop(self):
+        self.running = False
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def _loop(self):
+        while self.running:
+            try:
+                datagram, addr = self.sock.recvfrom(_DATAGRAM_SIZE)
+            except OSError:
+                break  # socket closed by stop()
+            try:
+                self.handle(memoryview(datagram), addr)
+            except Exception as e:
+                print(f"UDP command failed: {e}")
+
+    def handle(self, datagram, addr):
+        """Authenticates and runs one command datagram, replying to addr."""
+        server = self.server
+        if len(datagram) <= _HEADER_SIZE:
+            self.dropped += 1
+            return
+        nonce = bytes(datagram[:_NONCE_SIZE])
+        payload = datagram[_HEADER_SIZE:]
+        # Check the tag before charging the rate limit, so forged datagrams
+        # with a spoofed source cannot drain a real controller's bucket
+        if not _tags_equal(datagram[_NONCE_SIZE:_HEADER_SIZE], _hmac(self._pads, nonce, payload)):
+            self.dropped += 1
+            return
+        counter = int.from_bytes(nonce, 'big')
+        if (counter <= self._nonce or not server.admission.take_token(addr[0])
+                or not self._advance(counter)):
+            self.dropped += 1
+            return
+
+        started = ticks_us()
+        text = bytes(payload).decode()
+        space = text.find(' ')
+        path = text if space < 0 else text[:space]
+        headers = {':path': path, ':query': ''}
+        try:
+            body = json.loads(text[space + 1:]) if space >= 0 else {}
+            status_code, message = server._run_command(headers, path, body)
+        except ValueError:
+            status_code, message = 400, {"error": "Invalid JSON data"}
+
+        payload = str(status_code).encode() + b' ' + json.dumps(message).encode()
+        reply = nonce + _hmac(self._pads, nonce, payload) + payload
+        server.metrics.record(path, status_code, started)
+        # Deferred actions (e.g. restart) run once the reply is out
+        self.sock.sendto(reply, addr)
+        server._run_deferred(headers)
+
+    def _load_reserved(self):
+        """Returns the reservation stored by _advance, 0 if there is none."""
+        try:
+            with open(self.nonce_file, 'rb') as f:
+                data = f.read(_NONCE_SIZE)
+            return int.from_bytes(data, 'big') if len(data) == _NONCE_SIZE else 0
+        except OSError:
+            return 0
+
+    def _advance(self, counter):
+        """
+        Raises the high-water mark to counter. When it reaches the stored
+        reservation, a new one (counter + nonce_lease) is written to flash
+        first; returns False, refusing the command, if that write fails.
+        """
+        if counter >= self._reserved:
+            reserved = min(counter + self.nonce_lease, _NONCE_MAX)
+            temp = self.nonce_file + TEMP_SUFFIX
+            try:
+                with open(temp, 'wb') as f:
+                    f.write(reserved.to_bytes(_NONCE_SIZE, 'big'))
+                replace_file(temp, self.nonce_file)
+            except OSError as e:
+                print(f"UDP nonce reservation failed: {e}")
+                return False
+            self._reserved = reserved
+        self._nonce = counter
+        return True
+
+    def render(self, stream):
+        """Writes the drop counter in Prometheus text exposition format."""
+        write = stream.write
+        write("# HELP udp_dropped_total Command datagrams dropped (rate limit, bad tag, replayed nonce).\n")
+        write("# TYPE udp_dropped_total counter\n")
+        write(f"udp_dropped_total {self.dropped}\n")
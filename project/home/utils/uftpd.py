@@ -12,6 +12,15 @@
 # port is the port number (default 21)
 # verbose controls the level of printed activity messages, values 0, 1, 2
 #
+# Up to `sessions` clients are served at once. Each passive session gets its
+# own data port (13333, 13334, ...) and RETR/STOR run in a thread per
+# transfer, so one client can list or upload while another is transferring.
+#
+# MODE Z (RFC 1950 zlib stream on the data connection) is offered when the
+# firmware has the deflate module; downloads use a 1 KiB window, and
+# uploads whose zlib header asks for more than `zlib_window` bits are
+# refused, as the inflater allocates that window for the transfer.
+#
 # Copyright (c) 2016 Christopher Popp (initial ftp server framework)
 # Copyright (c) 2016 Paul Sokolovsky (background execution control structure)
 # Copyright (c) 2016 Robert Hammelrath (putting the pieces together and a
@@ -26,27 +35,83 @@ import uos
 import gc
 import sys
 import errno
+import _thread
+import hashlib
+import io
+from binascii import crc32, hexlify
 from time import sleep_ms, localtime
-from micropython import alloc_emergency_exception_buf
+from micropython import alloc_emergency_exception_buf, const
+from home.utils.block_writer import BlockWriter
+from home.utils.fs_common import (TEMP_SUFFIX, listing_cache, digest_cache,
+                                  replace_file, invalidate_listing, forget_digest)
+try:
+    import deflate  # MODE Z; the firmware's module behind lib/zlib.mpy
+except ImportError:
+    deflate = None
 
 # constant definitions
 _CHUNK_SIZE = const(1024)
+_MIN_CHUNK_SIZE = const(512)
+_MAX_CHUNK_SIZE = const(8192)
+_UPLOAD_BLOCK_SIZE = const(4096)  # one flash sector, whatever chunk_size is
 _SO_REGISTER_HANDLER = const(20)
 _COMMAND_TIMEOUT = const(300)
 _DATA_TIMEOUT = const(100)
 _DATA_PORT = const(13333)
+_MAX_SESSIONS = const(3)
+_LISTING_CACHE_SIZE = const(8)
+_DIGEST_CACHE_SIZE = const(256)
+_ZLIB_WBITS = const(10)  # 1 KiB deflate window for MODE Z downloads
+_MAX_ZLIB_WBITS = const(15)  # largest window a zlib header can name
+_STREAM_CLOSE = const(4)  # stream protocol ioctl request for close()
+# listing styles: names only (NLST), ls -l (LIST), facts (MLSD)
+_NAMES = const(0)
+_LONG = const(1)
+_FACTS = const(2)
+_HASHES = ("SHA-256", "CRC32")
+# SITE ARCHIVE/EXTRACT stream ustar archives, made of 512 byte blocks
+_TAR_BLOCK = const(512)
+_TAR_ZEROS = memoryview(bytes(_TAR_BLOCK))
+# tar stores Unix time; ports with a 2000 epoch report mtime from 2000
+_UNIX_EPOCH = 946684800 if localtime(0)[0] == 2000 else 0
 
 # Global variables
 ftpsockets = []
-datasocket = None
+# Passive mode listening sockets, one per session (ports _DATA_PORT + i)
+datasockets = []
+free_datasockets = []
 client_list = []
+max_sessions = _MAX_SESSIONS
 verbose_l = 0
-client_busy = False
+# Transfer buffers (memoryviews) allocated once by start_ftp_server
+chunk_size = _CHUNK_SIZE
+buffer_pool = []
+# Upload blocks (memoryviews): STOR and SITE EXTRACT write to flash in
+# whole sectors; allocated on first use and kept for the next upload
+upload_blocks = []
+# largest inflate window (bits) accepted for MODE Z uploads
+zlib_window = _ZLIB_WBITS
+# digests kept for SITE MANIFEST; above a tree's file count every
+# manifest hashes files again
+digest_cache_size = _DIGEST_CACHE_SIZE
+# listing_cache and digest_cache live in fs_common, shared with the
+# command server's HTTP uploads; see list_directory and cached_digest
 # Interfaces: (IP-Address (string), IP-Address (integer), Netmask (integer))
 
 _month_name = ("", "Jan", "Feb", "Mar", "Apr", "May", "Jun",
                "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
 
+_FEATURES = ("211-Features:\r\n"
+             " MLST type*;size*;modify*;unique*;\r\n"
+             " MLSD\r\n"
+             " SIZE\r\n"
+             " MDTM\r\n"
+             " REST STREAM\r\n"
+             " HASH SHA-256*;CRC32\r\n"
+             " XCRC\r\n" +
+             (" MODE Z\r\n" if deflate else "") +
+             "211 End\r\n")
+
 
 class FTP_client:
 
@@ -55,10 +120,25 @@ class FTP_client:
         self.remote_addr = self.remote_addr[0]
         self.command_client.settimeout(_COMMAND_TIMEOUT)
         log_msg(1, "FTP Command connection from:", self.remote_addr)
+        self.init_session(local_addr)
         self.command_client.setsockopt(socket.SOL_SOCKET,
                                        _SO_REGISTER_HANDLER,
                                        self.exec_ftp_command)
         self.command_client.sendall("220 Hello, this is the {}.\r\n".format(sys.platform))
+
+    # a session without a control connection, for driving the transfer
+    # methods directly (host benchmarks); it gets the same state as a
+    # connected one, so new session attributes need no changes there
+    @classmethod
+    def detached(cls, local_addr="127.0.0.1"):
+        client = cls.__new__(cls)
+        client.command_client = None
+        client.remote_addr = local_addr
+        client.init_session(local_addr)
+        return client
+
+    # per-session state, reset for each control connection
+    def init_session(self, local_addr):
         self.cwd = '/'
         self.fromname = None
 #        self.logged_in = False
@@ -66,22 +146,62 @@ class FTP_client:
         self.DATA_PORT = 20
         self.active = True
         self.pasv_data_addr = local_addr
+        self.datasocket = None  # taken from free_datasockets on PASV
+        self.busy = False  # a RETR/STOR runs in this session's transfer thread
+        self.rest_offset = 0  # set by REST, used by the next RETR/STOR
+        self.mode_z = False  # MODE Z: data connections carry a zlib stream
+        self.hash_name = _HASHES[0]  # algorithm of HASH, set by OPTS HASH
 
-    def send_list_data(self, path, data_client, full):
+    def send_list_data(self, path, data_client, style):
+        pattern = None
         try:
-            for fname in uos.listdir(path):
-                data_client.sendall(self.make_description(path, fname, full))
+            entries = self.list_directory(path, style)
         except Exception as e:  # path may be a file name or pattern
             path, pattern = self.split_path(path)
             try:
-                for fname in uos.listdir(path):
-                    if self.fncmp(fname, pattern):
-                        data_client.sendall(
-                            self.make_description(path, fname, full))
+                entries = self.list_directory(path, style)
             except:
-                pass
+                return
+        # pack the lines into a transfer buffer and send it when full
+        mv = borrow_buffer()
+        try:
+            pos = 0
+            for fname, line in entries:
+                if pattern is not None and not self.fncmp(fname, pattern):
+                    continue
+                size = len(line)
+                if pos + size > len(mv):
+                    data_client.write(mv[0:pos])
+                    pos = 0
+                    if size > len(mv):
+                        data_client.write(line)
+                        continue
+                mv[pos:pos + size] = line
+                pos += size
+            if pos:
+                data_client.write(mv[0:pos])
+        finally:
+            return_buffer(mv)
 
-    def make_description(self, path, fname, full):
+    # formatted listing of a directory, served from listing_cache until
+    # a command changes the directory
+    def list_directory(self, path, style):
+        key = (path, style)
+        entries = listing_cache.get(key)
+        if entries is None:
+            if style == _FACTS:
+                entries = [(fname, self.make_facts(path, fname).encode())
+                           for fname in uos.listdir(path)]
+            else:
+                year = localtime()[0]
+                entries = [(fname, self.make_description(path, fname, style, year).encode())
+                           for fname in uos.listdir(path)]
+            if len(listing_cache) >= _LISTING_CACHE_SIZE:
+                listing_cache.popitem()
+            listing_cache[key] = entries
+        return entries
+
+    def make_description(self, path, fname, full, year=None):
         global _month_name
         if full:
             stat = uos.stat(self.get_absolute_path(path, fname))
@@ -91,7 +211,7 @@ class FTP_client:
             file_size = stat[6]
             tm = stat[7] & 0xffffffff
             tm = localtime(tm if tm < 0x80000000 else tm - 0x100000000)
-            if tm[0] != localtime()[0]:
+            if tm[0] != (localtime()[0] if year is None else year):
                 description = "{} 1 owner group {:>10} {} {:2} {:>5} {}\r\n".\
                     format(file_permissions, file_size,
                         _month_name[tm[1]], tm[2], tm[0], fname)
@@ -103,25 +223,205 @@ class FTP_client:
             description = fname + "\r\n"
         return description
 
-    def send_file_data(self, path, data_client):
-        buffer = bytearray(_CHUNK_SIZE)
-        mv = memoryview(buffer)
-        with open(path, "rb") as file:
-            bytes_read = file.readinto(buffer)
-            while bytes_read > 0:
-                data_client.write(mv[0:bytes_read])
-                bytes_read = file.readinto(buffer)
-            data_client.close()
-
-    def save_file_data(self, path, data_client, mode):
-        buffer = bytearray(_CHUNK_SIZE)
-        mv = memoryview(buffer)
-        with open(path, mode) as file:
-            bytes_read = data_client.readinto(buffer)
-            while bytes_read > 0:
-                file.write(mv[0:bytes_read])
-                bytes_read = data_client.readinto(buffer)
-            data_client.close()
+    # MLSD/MLST line: "type=file;size=12;modify=20240131120000;unique=1f; name"
+    # name defaults to fname; MLST shows the full path instead
+    def make_facts(self, path, fname, name=None):
+        abs_path = self.get_absolute_path(path, fname)
+        stat = uos.stat(abs_path)
+        tm = localtime(stat[8])
+        modify = "{:04d}{:02d}{:02d}{:02d}{:02d}{:02d}".format(*tm[0:6])
+        # the inode where the file system has one, else a path hash
+        unique = stat[1] or (hash(abs_path) & 0xffffffff)
+        return "type={};size={};modify={};unique={:x}; {}\r\n".format(
+            "dir" if stat[0] & 0o170000 == 0o040000 else "file",
+            stat[6], modify, unique, fname if name is None else name)
+
+    # MODE Z: deflate (compress=True) or inflate the data connection.
+    # Deflating uses a 1 KiB window; inflating uses the window named in
+    # the client's zlib header, which ZlibHeader checks against
+    # zlib_window before anything is allocated for it.
+    def data_stream(self, data_client, compress):
+        if not self.mode_z:
+            return data_client
+        if compress:
+            return deflate.DeflateIO(data_client, deflate.ZLIB, _ZLIB_WBITS, True)
+        source = ZlibHeader(data_client)
+        return deflate.DeflateIO(source, deflate.ZLIB, source.wbits, True)
+
+    def send_file_data(self, path, data_client, offset=0):
+        mv = borrow_buffer()
+        try:
+            with open(path, "rb") as file:
+                if offset:
+                    file.seek(offset)
+                out = self.data_stream(data_client, True)
+                bytes_read = file.readinto(mv)
+                while bytes_read > 0:
+                    out.write(mv[0:bytes_read])
+                    bytes_read = file.readinto(mv)
+                out.close()
+        finally:
+            return_buffer(mv)
+
+    # STOR goes to a temporary file that replaces the target only when
+    # the upload completed, so an interrupted upload leaves the old file
+    # intact. The temporary file is kept when an upload fails: SIZE
+    # reports its length and REST + STOR/APPE resume into it. Only a
+    # plain APPE writes to the target itself.
+    def save_file_data(self, path, data_client, mode, offset=0):
+        target = path + TEMP_SUFFIX if mode == "wb" or offset else path
+        if offset:
+            # resume (REST): append if offset is the end of the partial
+            # upload, else overwrite from offset on
+            size = uos.stat(target)[6]
+            if offset > size:
+                raise ValueError("offset beyond end of partial upload")
+            mode = "ab" if offset == size else "r+b"
+        # a refused zlib header fails the upload before the file is touched
+        source = self.data_stream(data_client, False)
+        mv = borrow_block()
+        try:
+            with open(target, mode) as file:
+                if mode == "r+b":
+                    file.seek(offset)
+                # socket reads go straight into the upload block,
+                # which is written to flash only when full
+                writer = BlockWriter(file, mv, offset)
+                while writer.readfrom(source) > 0:
+                    pass
+                writer.flush()
+                source.close()
+            if target != path:
+                replace_file(target, path)
+        finally:
+            return_block(mv)
+            invalidate_listing(self.split_path(path)[0])
+            forget_digest(path)
+
+    # length of the partial upload of path, or -1 if there is none
+    def partial_size(self, path):
+        try:
+            return uos.stat(path + TEMP_SUFFIX)[6]
+        except OSError:
+            return -1
+
+    # SITE MANIFEST: one line per entry below path, walked once:
+    # "<sha256> <size> <mtime> <relative path>" for files and
+    # "- 0 <mtime> <relative path>/" for directories
+    def send_manifest(self, path, data_client):
+        out = self.data_stream(data_client, True)
+        root = path.rstrip('/')
+        pending = [""]
+        while pending:
+            rel = pending.pop()
+            for fname in uos.listdir(root + rel or '/'):
+                if fname.endswith(TEMP_SUFFIX):
+                    continue  # upload in progress
+                name = rel + '/' + fname
+                stat = uos.stat(root + name)
+                if (stat[0] & 0o170000) == 0o040000:
+                    out.write("- 0 {} {}/\r\n".format(stat[8], name[1:]).encode())
+                    pending.append(name)
+                else:
+                    out.write("{} {} {} {}\r\n".format(
+                        cached_digest(root + name, stat), stat[6], stat[8],
+                        name[1:]).encode())
+        out.close()
+
+    # SITE ARCHIVE: the tree below path as a ustar archive, directories
+    # before their contents
+    def send_archive(self, path, data_client):
+        out = self.data_stream(data_client, True)
+        mv = borrow_buffer()
+        try:
+            root = path.rstrip('/')
+            pending = [""]
+            while pending:
+                rel = pending.pop()
+                for fname in uos.listdir(root + rel or '/'):
+                    if fname.endswith(TEMP_SUFFIX):
+                        continue
+                    name = rel + '/' + fname
+                    stat = uos.stat(root + name)
+                    if (stat[0] & 0o170000) == 0o040000:
+                        tar_header(mv, name[1:] + '/', 0, stat[8], True)
+                        out.write(mv[0:_TAR_BLOCK])
+                        pending.append(name)
+                        continue
+                    tar_header(mv, name[1:], stat[6], stat[8], False)
+                    out.write(mv[0:_TAR_BLOCK])
+                    remaining = stat[6]
+                    with open(root + name, "rb") as file:
+                        while remaining:
+                            bytes_read = file.readinto(mv[0:min(len(mv), remaining)])
+                            if not bytes_read:
+                                raise OSError("file shrank: " + name)
+                            out.write(mv[0:bytes_read])
+                            remaining -= bytes_read
+                    if stat[6] % _TAR_BLOCK:
+                        out.write(_TAR_ZEROS[0:-stat[6] % _TAR_BLOCK])
+            out.write(_TAR_ZEROS)  # end of archive: two zero blocks
+            out.write(_TAR_ZEROS)
+            out.close()
+        finally:
+            return_buffer(mv)
+
+    # SITE EXTRACT: unpack a ustar archive into path. Each file is
+    # written to a temporary file and renamed like a STOR; entries
+    # other than files and directories are skipped.
+    def save_archive(self, path, data_client):
+        source = self.data_stream(data_client, False)
+        # file data is copied in whole upload blocks, so it reaches
+        # flash in sector-sized writes like a STOR
+        mv = borrow_block()
+        root = path.rstrip('/')
+        try:
+            try:
+                uos.mkdir(path)
+            except OSError:
+                pass  # exists
+            long_name = None
+            while read_exact(source, mv[0:_TAR_BLOCK]) and mv[0]:
+                name, size, kind = tar_entry(mv)
+                if long_name is not None:
+                    name, long_name = long_name, None
+                if kind in "LxX":  # GNU long name or pax header for the next entry
+                    long_name = tar_long_name(kind, source, mv, size)
+                    continue
+                parts = [p for p in name.split('/') if p != '' and p != '.']
+                if ".." in parts or (not parts and kind != "5"):
+                    raise ValueError("bad archive path: " + name)
+                target = root + '/' + '/'.join(parts)
+                if kind == "5":
+                    make_dirs(root, parts)
+                elif kind == "0" or kind == "\0":
+                    try:
+                        try:
+                            file = open(target + TEMP_SUFFIX, "wb")
+                        except OSError:
+                            # archives need not list the parent directories
+                            make_dirs(root, parts[:-1])
+                            file = open(target + TEMP_SUFFIX, "wb")
+                        with file:
+                            tar_copy(source, mv, size, file)
+                        replace_file(target + TEMP_SUFFIX, target)
+                        forget_digest(target)
+                    except:
+                        try:
+                            uos.remove(target + TEMP_SUFFIX)
+                        except OSError:
+                            pass
+                        raise
+                else:
+                    tar_copy(source, mv, size, None)
+            # tar pads archives to whole records; take the rest before closing
+            while source.readinto(mv) > 0:
+                pass
+            source.close()
+        finally:
+            return_block(mv)
+            listing_cache.clear()
+            invalidate_listing(path)
 
     def get_absolute_path(self, cwd, payload):
         # Just a few special cases "..", "." and ""
@@ -177,13 +477,61 @@ class FTP_client:
             data_client.connect((self.act_data_addr, self.DATA_PORT))
             log_msg(1, "FTP Data connection with:", self.act_data_addr)
         else:  # passive mode
-            data_client, data_addr = datasocket.accept()
+            data_client, data_addr = self.datasocket.accept()
             log_msg(1, "FTP Data connection with:", data_addr[0])
         return data_client
 
+    # close the data connection a passive client opened for a transfer
+    # that was refused, so the next transfer does not accept it instead
+    def discard_dataclient(self):
+        if self.active or self.datasocket is None:
+            return
+        self.datasocket.settimeout(0)
+        try:
+            self.datasocket.accept()[0].close()
+        except OSError:
+            pass  # the client had not connected
+        self.datasocket.settimeout(10)
+
+    def release_datasocket(self):
+        if self.datasocket is not None:
+            free_datasockets.append(self.datasocket)
+            self.datasocket = None
+
+    # run RETR/STOR in a thread, so that the other sessions' commands
+    # are handled while the data is moving
+    def start_transfer(self, cl, transfer, *args):
+        self.busy = True
+        try:
+            _thread.start_new_thread(self.run_transfer, (cl, transfer, args))
+        except Exception:
+            self.busy = False
+            cl.sendall('451 Cannot start transfer.\r\n')
+
+    def run_transfer(self, cl, transfer, args):
+        data_client = None
+        try:
+            data_client = self.open_dataclient()
+            cl.sendall("150 Opened data connection.\r\n")
+            transfer(args[0], data_client, *args[1:])
+            # if the next statement is reached,
+            # the data_client was closed.
+            data_client = None
+            reply = "226 Done.\r\n"
+        except Exception as err:
+            log_msg(1, "Transfer failed: {}".format(err))
+            reply = '550 Fail\r\n'
+            if data_client is not None:
+                data_client.close()
+        # the client may send its next command as soon as it has the
+        # reply, so the session must not be busy any more by then
+        self.busy = False
+        try:
+            cl.sendall(reply)
+        except OSError:
+            pass
+
     def exec_ftp_command(self, cl):
-        global datasocket
-        global client_busy
         global my_ip_addr
 
         try:
@@ -204,11 +552,6 @@ class FTP_client:
                 close_client(cl)
                 return
 
-            if client_busy:  # check if another client is busy
-                cl.sendall("400 Device busy.\r\n")  # tell so the remote client
-                return  # and quit
-            client_busy = True  # now it's my turn
-
             # check for log-in state may done here, like
             # if self.logged_in == False and not command in\
             #    ("USER", "PASS", "QUIT"):
@@ -220,6 +563,11 @@ class FTP_client:
             path = self.get_absolute_path(self.cwd, payload)
             log_msg(1, "Command={}, Payload={}".format(command, payload))
 
+            if self.busy and command not in ("NOOP", "STAT", "QUIT"):
+                # this session's transfer is still running
+                cl.sendall("450 Transfer in progress.\r\n")
+                return
+
             if command == "USER":
                 # self.logged_in = True
                 cl.sendall("230 Logged in.\r\n")
@@ -234,6 +582,28 @@ class FTP_client:
                 cl.sendall("230 Logged in.\r\n")
             elif command == "SYST":
                 cl.sendall("215 UNIX Type: L8\r\n")
+            elif command == "FEAT":
+                cl.sendall(_FEATURES)
+            elif command == "MODE":
+                mode = payload.upper()
+                if mode == "S" or (mode == "Z" and deflate is not None):
+                    self.mode_z = mode == "Z"
+                    cl.sendall('200 OK\r\n')
+                else:
+                    cl.sendall('504 Unsupported mode\r\n')
+            elif command == "OPTS":
+                option = payload.upper()
+                if option.startswith("HASH"):
+                    name = option[4:].strip()
+                    if name in _HASHES:
+                        self.hash_name = name
+                    if name == "" or name == self.hash_name:
+                        cl.sendall('200 {}\r\n'.format(self.hash_name))
+                    else:
+                        cl.sendall('501 Unknown algorithm\r\n')
+                else:
+                    # UTF8 and the MLST fact selection; all facts are always sent
+                    cl.sendall('200 OK\r\n')
             elif command in ("TYPE", "NOOP", "ABOR"):  # just accept & ignore
                 cl.sendall('200 OK\r\n')
             elif command == "QUIT":
@@ -251,10 +621,16 @@ class FTP_client:
                 except:
                     cl.sendall('550 Fail\r\n')
             elif command == "PASV":
-                cl.sendall('227 Entering Passive Mode ({},{},{}).\r\n'.format(
-                    self.pasv_data_addr.replace('.', ','),
-                    _DATA_PORT >> 8, _DATA_PORT % 256))
-                self.active = False
+                if self.datasocket is None and free_datasockets:
+                    self.datasocket = free_datasockets.pop()
+                if self.datasocket is None:
+                    cl.sendall('425 No data port available.\r\n')
+                else:
+                    port = _DATA_PORT + datasockets.index(self.datasocket)
+                    cl.sendall('227 Entering Passive Mode ({},{},{}).\r\n'.format(
+                        self.pasv_data_addr.replace('.', ','),
+                        port >> 8, port % 256))
+                    self.active = False
             elif command == "PORT":
                 items = payload.split(",")
                 if len(items) >= 6:
@@ -267,54 +643,68 @@ class FTP_client:
                     self.active = True
                 else:
                     cl.sendall('504 Fail\r\n')
-            elif command == "LIST" or command == "NLST":
+            elif command == "LIST" or command == "NLST" or command == "MLSD":
                 if payload.startswith("-"):
                     option = payload.split()[0].lower()
                     path = self.get_absolute_path(
                             self.cwd, payload[len(option):].lstrip())
                 else:
                     option = ""
+                if command == "MLSD":
+                    style = _FACTS
+                elif command == "LIST" or 'l' in option:
+                    style = _LONG
+                else:
+                    style = _NAMES
                 try:
                     data_client = self.open_dataclient()
                     cl.sendall("150 Directory listing:\r\n")
-                    self.send_list_data(path, data_client,
-                                        command == "LIST" or 'l' in option)
+                    out = self.data_stream(data_client, True)
+                    self.send_list_data(path, out, style)
+                    out.close()
                     cl.sendall("226 Done.\r\n")
                     data_client.close()
                 except:
                     cl.sendall('550 Fail\r\n')
                     if data_client is not None:
                         data_client.close()
-            elif command == "RETR":
+            elif command == "MLST":
                 try:
-                    data_client = self.open_dataclient()
-                    cl.sendall("150 Opened data connection.\r\n")
-                    self.send_file_data(path, data_client)
-                    # if the next statement is reached,
-                    # the data_client was closed.
-                    data_client = None
-                    cl.sendall("226 Done.\r\n")
+                    cl.sendall("250-Listing {}\r\n {}250 End.\r\n".format(
+                        path, self.make_facts(path, "", path)))
                 except:
                     cl.sendall('550 Fail\r\n')
-                    if data_client is not None:
-                        data_client.close()
-            elif command == "STOR" or command == "APPE":
+            elif command == "REST":
                 try:
-                    data_client = self.open_dataclient()
-                    cl.sendall("150 Opened data connection.\r\n")
-                    self.save_file_data(path, data_client,
-                                        "wb" if command == "STOR" else "ab")
-                    # if the next statement is reached,
-                    # the data_client was closed.
-                    data_client = None
-                    cl.sendall("226 Done.\r\n")
-                except:
-                    cl.sendall('550 Fail\r\n')
-                    if data_client is not None:
-                        data_client.close()
+                    self.rest_offset = int(payload)
+                    if self.rest_offset < 0:
+                        raise ValueError
+                    cl.sendall("350 Restarting at {}.\r\n".format(self.rest_offset))
+                except ValueError:
+                    self.rest_offset = 0
+                    cl.sendall('501 Invalid offset\r\n')
+            elif command == "RETR":
+                offset, self.rest_offset = self.rest_offset, 0
+                self.start_transfer(cl, self.send_file_data, path, offset)
+            elif command == "STOR" or command == "APPE":
+                offset, self.rest_offset = self.rest_offset, 0
+                # a resume continues a failed upload's .part file; never
+                # splice the new data into the live target
+                if offset and self.partial_size(path) < offset:
+                    self.discard_dataclient()
+                    cl.sendall('554 No partial upload to resume at {}.\r\n'.format(offset))
+                else:
+                    invalidate_listing(self.split_path(path)[0])
+                    self.start_transfer(cl, self.save_file_data, path,
+                                        "wb" if command == "STOR" else "ab", offset)
             elif command == "SIZE":
+                # while a failed upload is pending, report how much of it
+                # arrived so that clients resume it with REST
+                size = self.partial_size(path)
                 try:
-                    cl.sendall('213 {}\r\n'.format(uos.stat(path)[6]))
+                    if size < 0:
+                        size = uos.stat(path)[6]
+                    cl.sendall('213 {}\r\n'.format(size))
                 except:
                     cl.sendall('550 Fail\r\n')
             elif command == "MDTM":
@@ -323,6 +713,35 @@ class FTP_client:
                     cl.sendall('213 {:04d}{:02d}{:02d}{:02d}{:02d}{:02d}\r\n'.format(*tm[0:6]))
                 except:
                     cl.sendall('550 Fail\r\n')
+            elif command == "HASH":
+                try:
+                    digest = file_digest(path, self.hash_name)
+                    cl.sendall('213 {} 0-{} {} {}\r\n'.format(
+                        self.hash_name, uos.stat(path)[6], digest, path))
+                except:
+                    cl.sendall('550 Fail\r\n')
+            elif command == "XCRC":
+                try:
+                    cl.sendall('250 {}\r\n'.format(file_digest(path, "CRC32")))
+                except:
+                    cl.sendall('550 Fail\r\n')
+            elif command == "SITE":
+                words = payload.split(None, 1)
+                site = words[0].upper() if words else ""
+                path = self.get_absolute_path(self.cwd, words[1] if len(words) > 1 else "")
+                if site == "MANIFEST":
+                    self.start_transfer(cl, self.send_manifest, path)
+                elif site == "ARCHIVE":
+                    self.start_transfer(cl, self.send_archive, path)
+                elif site == "EXTRACT":
+                    self.start_transfer(cl, self.save_archive, path)
+                else:
+                    # anything else is Python code to run, as before
+                    try:
+                        exec(payload.replace('\0','\n'))
+                        cl.sendall('250 OK\r\n')
+                    except:
+                        cl.sendall('550 Fail\r\n')
             elif command == "STAT":
                 if payload == "":
                     cl.sendall("211-Connected to ({})\r\n"
@@ -339,6 +758,8 @@ class FTP_client:
             elif command == "DELE":
                 try:
                     uos.remove(path)
+                    invalidate_listing(self.split_path(path)[0])
+                    forget_digest(path)
                     cl.sendall('250 OK\r\n')
                 except:
                     cl.sendall('550 Fail\r\n')
@@ -353,6 +774,10 @@ class FTP_client:
             elif command == "RNTO":
                     try:
                         uos.rename(self.fromname, path)
+                        invalidate_listing(self.split_path(self.fromname)[0])
+                        invalidate_listing(self.split_path(path)[0])
+                        forget_digest(self.fromname, True)
+                        forget_digest(path, True)
                         cl.sendall('250 OK\r\n')
                     except:
                         cl.sendall('550 Fail\r\n')
@@ -363,18 +788,15 @@ class FTP_client:
             elif command == "RMD" or command == "XRMD":
                 try:
                     uos.rmdir(path)
+                    invalidate_listing(self.split_path(path)[0])
+                    invalidate_listing(path)
                     cl.sendall('250 OK\r\n')
                 except:
                     cl.sendall('550 Fail\r\n')
             elif command == "MKD" or command == "XMKD":
                 try:
                     uos.mkdir(path)
-                    cl.sendall('250 OK\r\n')
-                except:
-                    cl.sendall('550 Fail\r\n')
-            elif command == "SITE":
-                try:
-                    exec(payload.replace('\0','\n'))
+                    invalidate_listing(self.split_path(path)[0])
                     cl.sendall('250 OK\r\n')
                 except:
                     cl.sendall('550 Fail\r\n')
@@ -392,8 +814,207 @@ class FTP_client:
         # handle unexpected errors
         except Exception as err:
             log_msg(1, "Exception in exec_ftp_command: {}".format(err))
-        # tidy up before leaving
-        client_busy = False
+
+
+def allocate_buffers(size=_CHUNK_SIZE, count=1):
+    # (re)create the transfer buffer pool; size is clamped to 512..8192
+    global chunk_size, buffer_pool
+    chunk_size = max(_MIN_CHUNK_SIZE, min(size, _MAX_CHUNK_SIZE))
+    buffer_pool = [memoryview(bytearray(chunk_size)) for _ in range(count)]
+
+
+def borrow_buffer():
+    # take a transfer buffer from the pool; only allocate if it is empty
+    try:
+        return buffer_pool.pop()
+    except IndexError:
+        return memoryview(bytearray(chunk_size))
+
+
+def return_buffer(mv):
+    if len(mv) == chunk_size:
+        buffer_pool.append(mv)
+
+
+def borrow_block():
+    # take an upload block from the pool; only allocate if it is empty
+    try:
+        return upload_blocks.pop()
+    except IndexError:
+        return memoryview(bytearray(_UPLOAD_BLOCK_SIZE))
+
+
+def return_block(mv):
+    upload_blocks.append(mv)
+
+
+# checksum of a file, streamed through a transfer buffer:
+# name is "SHA-256" (lower case hex) or "CRC32" (8 upper case hex digits)
+def file_digest(path, name):
+    mv = borrow_buffer()
+    try:
+        crc = 0
+        sha = hashlib.sha256() if name == "SHA-256" else None
+        with open(path, "rb") as file:
+            bytes_read = file.readinto(mv)
+            while bytes_read > 0:
+                if sha:
+                    sha.update(mv[0:bytes_read])
+                else:
+                    crc = crc32(mv[0:bytes_read], crc)
+                bytes_read = file.readinto(mv)
+        if sha:
+            return hexlify(sha.digest()).decode()
+        return "{:08X}".format(crc & 0xFFFFFFFF)
+    finally:
+        return_buffer(mv)
+
+
+# write a ustar header block into mv[0:512]; names over 100 bytes are
+# split at a '/' into the prefix field
+def tar_header(mv, name, size, mtime, is_dir):
+    mv[0:_TAR_BLOCK] = _TAR_ZEROS
+    name = name.encode()
+    prefix = b""
+    if len(name) > 100:
+        cut = name.find(b"/", len(name) - 101)
+        if cut < 0 or cut > 155:
+            raise ValueError("name too long for ustar")
+        prefix, name = name[:cut], name[cut + 1:]
+    mv[0:len(name)] = name
+    mv[100:108] = b"0000755\0" if is_dir else b"0000644\0"
+    mv[108:116] = b"0000000\0"
+    mv[116:124] = b"0000000\0"
+    mv[124:136] = "{:011o}\0".format(size).encode()
+    mv[136:148] = "{:011o}\0".format(mtime + _UNIX_EPOCH).encode()
+    mv[148:156] = b"        "
+    mv[156] = 53 if is_dir else 48  # '5' directory, '0' file
+    mv[257:265] = b"ustar\x0000"
+    mv[345:345 + len(prefix)] = prefix
+    mv[148:156] = "{:06o}\0 ".format(sum(mv[0:_TAR_BLOCK])).encode()
+
+
+def tar_field(mv, start, end):
+    field = bytes(mv[start:end])
+    nul = field.find(b"\0")
+    return (field if nul < 0 else field[:nul]).decode()
+
+
+# (name, size, type flag) of the header block in mv[0:512]
+def tar_entry(mv):
+    checksum = sum(mv[0:148]) + 256 + sum(mv[156:_TAR_BLOCK])
+    if checksum != int(tar_field(mv, 148, 156).strip() or "0", 8):
+        raise ValueError("bad tar header checksum")
+    name = tar_field(mv, 0, 100)
+    if bytes(mv[257:262]) == b"ustar" and mv[345]:
+        name = tar_field(mv, 345, 500) + "/" + name
+    size = int(tar_field(mv, 124, 136).strip() or "0", 8)
+    return name, size, chr(mv[156]) if mv[156] else "\0"
+
+
+# name of the next entry from a GNU long name ('L') or pax ('x', 'X')
+# header; None if a pax header does not set the path
+def tar_long_name(kind, source, mv, size):
+    if size > len(mv):
+        raise ValueError("tar extended header too large")
+    read_exact(source, mv[0:size], True)
+    data = bytes(mv[0:size])
+    tar_skip_padding(source, mv, size)
+    if kind == "L":
+        return data.rstrip(b"\0").decode()
+    start = data.find(b" path=")
+    if start < 0:
+        return None
+    return data[start + 6:data.find(b"\n", start)].decode()
+
+
+# copy size bytes of entry data to file (or skip them if file is None)
+def tar_copy(source, mv, size, file):
+    remaining = size
+    while remaining:
+        count = min(len(mv), remaining)
+        read_exact(source, mv[0:count], True)
+        if file:
+            file.write(mv[0:count])
+        remaining -= count
+    tar_skip_padding(source, mv, size)
+
+
+# skip the zeros after size bytes of entry data up to the next block
+def tar_skip_padding(source, mv, size):
+    if size % _TAR_BLOCK:
+        read_exact(source, mv[0:_TAR_BLOCK - size % _TAR_BLOCK], True)
+
+
+# create root/parts[0], root/parts[0]/parts[1], ... where missing
+def make_dirs(root, parts):
+    for i in range(len(parts)):
+        try:
+            uos.mkdir(root + '/' + '/'.join(parts[:i + 1]))
+        except OSError:
+            pass  # exists
+
+
+# fill mv from source; False on a clean end of stream before any byte
+def read_exact(source, mv, required=False):
+    got = 0
+    while got < len(mv):
+        bytes_read = source.readinto(mv[got:])
+        if not bytes_read:
+            if got or required:
+                raise OSError("archive truncated")
+            return False
+        got += bytes_read
+    return True
+
+
+# Reads and checks the 2 byte zlib header (RFC 1950) of a MODE Z upload,
+# then hands it to the inflater again ahead of the rest of the stream.
+# The header names the window the inflater allocates for the whole
+# transfer, up to 32 KiB; larger than zlib_window is refused.
+class ZlibHeader(io.IOBase):
+    def __init__(self, stream):
+        self.stream = stream
+        self.header = bytearray(2)
+        if not read_exact(stream, memoryview(self.header)):
+            raise ValueError("no zlib header")
+        cmf, flg = self.header
+        if cmf & 0x0f != 8 or (cmf << 8 | flg) % 31 or flg & 0x20:
+            raise ValueError("bad zlib header")
+        self.wbits = (cmf >> 4) + 8
+        if self.wbits > min(zlib_window, _MAX_ZLIB_WBITS):
+            raise ValueError("zlib window {} > {} bits".format(self.wbits, zlib_window))
+        self.pending = 2
+
+    def readinto(self, buf):
+        if self.pending:
+            count = min(self.pending, len(buf))
+            start = 2 - self.pending
+            buf[0:count] = self.header[start:start + count]
+            self.pending -= count
+            return count
+        return self.stream.readinto(buf)
+
+    # DeflateIO closes its stream through the stream protocol on
+    # MicroPython and through close() on the host stand-in
+    def ioctl(self, request, arg):
+        if request == _STREAM_CLOSE:
+            self.stream.close()
+        return 0
+
+    def close(self):
+        self.stream.close()
+
+
+# SHA-256 of a file, cached for as long as its size and mtime stay the same
+def cached_digest(path, stat):
+    entry = digest_cache.get(path)
+    if entry is None or entry[0] != stat[6] or entry[1] != stat[8]:
+        entry = (stat[6], stat[8], file_digest(path, "SHA-256"))
+        if len(digest_cache) >= digest_cache_size:
+            digest_cache.popitem()
+        digest_cache[path] = entry
+    return entry[2]
 
 
 def log_msg(level, *args):
@@ -408,12 +1029,21 @@ def close_client(cl):
     cl.close()
     for i, client in enumerate(client_list):
         if client.command_client == cl:
+            client.release_datasocket()
             del client_list[i]
             break
 
 
 def accept_ftp_connect(ftpsocket, local_addr):
-    # Accept new calls for the server
+    # Accept new calls for the server, up to max_sessions at a time
+    if len(client_list) >= max_sessions:
+        try:
+            temp_client, temp_addr = ftpsocket.accept()
+            temp_client.sendall("421 Too many connections.\r\n")
+            temp_client.close()
+        except:
+            pass
+        return
     try:
         client_list.append(FTP_client(ftpsocket, local_addr))
     except:
@@ -433,9 +1063,8 @@ def num_ip(ip):
 
 
 def stop():
-    global ftpsockets, datasocket
+    global ftpsockets, datasockets, free_datasockets
     global client_list
-    global client_busy
 
     for client in client_list:
         client.command_client.setsockopt(socket.SOL_SOCKET,
@@ -443,27 +1072,40 @@ def stop():
         client.command_client.close()
     del client_list
     client_list = []
-    client_busy = False
     for sock in ftpsockets:
         sock.setsockopt(socket.SOL_SOCKET, _SO_REGISTER_HANDLER, None)
         sock.close()
     ftpsockets = []
-    if datasocket is not None:
-        datasocket.close()
-        datasocket = None
+    listing_cache.clear()
+    digest_cache.clear()
+    for sock in datasockets:
+        sock.close()
+    datasockets = []
+    free_datasockets = []
 
 
 # start listening for ftp connections on port 21
-def start_ftp_server(port=21, verbose=0, splash=True):
-    global ftpsockets, datasocket
+# chunk_size is the transfer buffer size (512..8192 bytes) for downloads and
+# listings; uploads are written to flash in 4096 byte blocks regardless
+# sessions is the number of clients served (and transferring) at once
+def start_ftp_server(port=21, verbose=0, splash=True, chunk_size=_CHUNK_SIZE,
+                     sessions=_MAX_SESSIONS, window=_ZLIB_WBITS,
+                     digests=_DIGEST_CACHE_SIZE):
+    global ftpsockets, datasockets, free_datasockets
     global verbose_l
     global client_list
-    global client_busy
+    global max_sessions
+    global zlib_window
+    global digest_cache_size
 
     alloc_emergency_exception_buf(100)
     verbose_l = verbose
     client_list = []
-    client_busy = False
+    max_sessions = sessions
+    zlib_window = window
+    digest_cache_size = digests
+    # every session can run one transfer, each with its own buffer
+    allocate_buffers(chunk_size, sessions)
 
     for interface in [network.AP_IF, network.STA_IF]:
         wlan = network.WLAN(interface)
@@ -483,11 +1125,15 @@ def start_ftp_server(port=21, verbose=0, splash=True):
         if splash:
             print("FTP server started on {}:{}".format(ifconfig[0], port))
 
-    datasocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    datasocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    datasocket.bind(('0.0.0.0', _DATA_PORT))
-    datasocket.listen(1)
-    datasocket.settimeout(10)
+    datasockets = []
+    for i in range(sessions):
+        datasocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        datasocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        datasocket.bind(('0.0.0.0', _DATA_PORT + i))
+        datasocket.listen(1)
+        datasocket.settimeout(10)
+        datasockets.append(datasocket)
+    free_datasockets = datasockets[:]
 
 def restart_ftp_server(port=21, verbose=0, splash=True):
     stop()
@@ -0,0 +1,128 @@
+"""
+Delta deploy over FTP: uploads only the files that differ from the device.
+
+    python3 tools/ftp_sync.py <device-ip> [local_dir] [remote_dir]
+                              [--port 21] [--delete] [--dry-run]
+
+Fetches a manifest of remote_dir from uftpd (SITE MANIFEST: one walk of
+the tree, with SHA-256 digests cached on the device by mtime), compares
+it with local_dir and uploads the files whose size or digest differ,
+creating missing directories first. With --delete, files and directories
+that no longer exist locally are removed from the device. Every upload is
+checked with HASH, so nothing is read back.
+
+local_dir defaults to the repository's project/ and remote_dir to /.
+"""
+
+import argparse
+import ftplib
+import hashlib
+import os
+import sys
+
+SKIP_DIRS = ('__pycache__', '.git')
+SKIP_SUFFIXES = ('.pyc', '.part')
+
+
+def local_manifest(root):
+    """Returns ({relative path: (size, sha256 hex)}, {relative directory})."""
+    files = {}
+    dirs = set()
+    for directory, subdirs, names in os.walk(root):
+        subdirs[:] = sorted(d for d in subdirs if d not in SKIP_DIRS)
+        rel = os.path.relpath(directory, root).replace(os.sep, '/')
+        prefix = '' if rel == '.' else rel + '/'
+        if prefix:
+            dirs.add(rel)
+        for name in names:
+            if name.endswith(SKIP_SUFFIXES):
+                continue
+            with open(os.path.join(directory, name), 'rb') as f:
+                data = f.read()
+            files[prefix + name] = (len(data), hashlib.sha256(data).hexdigest())
+    return files, dirs
+
+
+def remote_manifest(ftp, root):
+    """Parses SITE MANIFEST into the same shape as local_manifest."""
+    files = {}
+    dirs = set()
+
+    def line(text):
+        digest, size, _mtime, name = text.split(' ', 3)
+        if digest == '-':
+            dirs.add(name.rstrip('/'))
+        else:
+            files[name] = (int(size), digest)
+
+    ftp.retrlines('SITE MANIFEST ' + root, line)
+    return files, dirs
+
+
+def remote_path(root, rel):
+    return root.rstrip('/') + '/' + rel
+
+
+def sync(ftp, local_root, remote_root, delete=False, dry_run=False):
+    """Brings remote_root in line with local_root; returns (uploaded, deleted)."""
+    local_files, local_dirs = local_manifest(local_root)
+    remote_files, remote_dirs = remote_manifest(ftp, remote_root)
+
+    uploads = sorted(rel for rel, entry in local_files.items()
+                     if remote_files.get(rel) != entry)
+    stale_files = sorted(set(remote_files) - set(local_files)) if delete else []
+    stale_dirs = sorted(remote_dirs - local_dirs, reverse=True) if delete else []
+
+    for rel in sorted(local_dirs - remote_dirs):
+        print(f"mkdir  {rel}/")
+        if not dry_run:
+            ftp.mkd(remote_path(remote_root, rel))
+    for rel in uploads:
+        size, digest = local_files[rel]
+        print(f"upload {rel} ({size} bytes)")
+        if dry_run:
+            continue
+        path = remote_path(remote_root, rel)
+        with open(os.path.join(local_root, rel), 'rb') as f:
+            ftp.storbinary('STOR ' + path, f)
+        reply = ftp.sendcmd('HASH ' + path).split(' ', 4)
+        if reply[3] != digest:
+            raise RuntimeError(f"{rel}: device has {reply[3]}, expected {digest}")
+    for rel in stale_files:
+        print(f"delete {rel}")
+        if not dry_run:
+            ftp.delete(remote_path(remote_root, rel))
+    for rel in stale_dirs:
+        print(f"rmdir  {rel}/")
+        if not dry_run:
+            ftp.rmd(remote_path(remote_root, rel))
+    return len(uploads), len(stale_files) + len(stale_dirs)
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('host')
+    parser.add_argument('local', nargs='?', default=os.path.join(here, '..', 'project'))
+    parser.add_argument('remote', nargs='?', default='/')
+    parser.add_argument('--port', type=int, default=21)
+    parser.add_argument('--delete', action='store_true',
+                        help="remove device files and directories missing locally")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="only print what would change")
+    args = parser.parse_args()
+
+    ftp = ftplib.FTP()
+    ftp.connect(args.host, args.port)
+    ftp.login()
+    ftp.sendcmd('OPTS HASH SHA-256')
+    try:
+        uploaded, deleted = sync(ftp, args.local, args.remote, args.delete, args.dry_run)
+    finally:
+        ftp.quit()
+    print(f"{uploaded} uploaded, {deleted} deleted")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())